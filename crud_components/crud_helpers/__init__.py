@@ -2,3 +2,6 @@ from .base_crud_handler import BaseCrudHandler
 from .db_helper import DbHelper
 from .crud_hook import CrudHook
 from .model_visitor import *
+from .search_count import CountStrategy
+from .search_cache import SearchResponseCache, SearchCacheBackend, LruCacheBackend
+from .single_flight import SingleFlight
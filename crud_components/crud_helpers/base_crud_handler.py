@@ -1,6 +1,7 @@
 import base64
 import json
 from Crypto.Hash import MD5
+from flask import current_app, stream_with_context
 from .crud_hook import CrudHook
 from .db_helper import DbHelper
 
@@ -35,6 +36,39 @@ class BaseCrudHandler(CrudHook):
             self.db.session.commit()
         return model_dict, code
 
+    def bulk_create(self, body, **kwargs):
+        # if at least one create fails, we should rollback all of them
+        self.db.session.begin(nested=True)
+        try:
+            for create_body in body.get("creates", []):
+                self.pre_create(create_body)
+            output, code = self.helper.bulk_create_helper(body, **kwargs)
+            for create_body, model_dict in zip(body.get("creates", []), output['results']):
+                self.post_create(create_body, model_dict)
+            self.on_success()
+            self.db.session.commit()
+        except Exception as e:
+            self.db.session.rollback()
+            self.on_failure(e)
+            raise e
+        if not self.nested:
+            self.db.session.commit()
+        return output, code
+
+    def upsert(self, body, **kwargs):
+        self.db.session.begin(nested=True)
+        try:
+            output, code = self.helper.upsert_helper(body, **kwargs)
+            self.on_success()
+            self.db.session.commit()
+        except Exception as e:
+            self.db.session.rollback()
+            self.on_failure(e)
+            raise e
+        if not self.nested:
+            self.db.session.commit()
+        return output, code
+
     def update(self, model_uid, body, **kwargs):
         self.db.session.begin(nested=True)
         try:
@@ -54,14 +88,16 @@ class BaseCrudHandler(CrudHook):
     def bulk_update(self, body, **kwargs):
         # if at least one update fails, we should rollback all changes including successful updates
         updates = body.get("updates", {})
+        # Only read the updated models back if someone is listening
+        with_results = type(self).post_update is not BaseCrudHandler.post_update
         self.db.session.begin(nested=True)
         try:
-            for uid_str, value in updates.items():
+            for uid_str in updates.keys():
                 self.pre_update(body, uid_str)
-                model_dict, code = self.helper.update_helper(uid_str, value, **kwargs)
-                self.post_update(body, model_dict)
-                # if code != 200: todo why are we returning 404?
-                #     return NoContent, 404
+            output, code = self.helper.bulk_update_helper(body, with_results=with_results, **kwargs)
+            if code == 200 and with_results:
+                for model_dict in output.pop('results'):
+                    self.post_update(body, model_dict)
             self.on_success()
             self.db.session.commit()
         except Exception as e:
@@ -70,7 +106,7 @@ class BaseCrudHandler(CrudHook):
             raise e
         if not self.nested:
             self.db.session.commit()
-        return dict(changes=1), 200
+        return output, code
 
     def delete(self, model_uid, **kwargs):
         model_dict, code = self.read(model_uid, None)
@@ -88,6 +124,33 @@ class BaseCrudHandler(CrudHook):
             self.db.session.commit()
         return res
 
+    def bulk_delete(self, body, **kwargs):
+        # The hooks get a summary of each row instead of a full read, and only if someone is listening
+        with_hooks = (type(self).pre_delete is not BaseCrudHandler.pre_delete
+                      or type(self).post_delete is not BaseCrudHandler.post_delete)
+        self.db.session.begin(nested=True)
+        try:
+            ids, summaries = None, ()
+            if with_hooks:
+                ids = self.helper.bulk_delete_ids(body, custom_filter=kwargs.get('custom_filter'))
+                if not isinstance(ids, list):
+                    ids = [pkey for pkey, in self.db.session.execute(ids)]
+                summaries = self.helper.delete_summaries(ids)
+            for summary in summaries:
+                self.pre_delete(summary)
+            res = self.helper.bulk_delete_helper(body, ids=ids, **kwargs)
+            for summary in summaries:
+                self.post_delete(summary)
+            self.on_success()
+            self.db.session.commit()
+        except Exception as e:
+            self.db.session.rollback()
+            self.on_failure(e)
+            raise e
+        if not self.nested:
+            self.db.session.commit()
+        return res
+
     def metadata(self, fields):
         return self.helper.metadata_helper(fields)
 
@@ -95,6 +158,34 @@ class BaseCrudHandler(CrudHook):
         return self.helper.query_search_helper(body, summary=False, exclude_fields=exclude_fields,
                                                include_fields=include_fields, **kwargs)
 
+    def search_many(self, bodies, exclude_fields=None, include_fields=None, **kwargs):
+        return self.helper.query_search_many(bodies, summary=False, exclude_fields=exclude_fields,
+                                             include_fields=include_fields, **kwargs)
+
+    @staticmethod
+    def search_across(searches, **kwargs):
+        """
+        Runs the searches of many handlers (e.g. of different models), each handler running its own at once
+        :param searches: a list of (handler, body)
+        :return: the list of (output, code), in the order of the searches
+        """
+        by_handler = dict()
+        for i, (handler, body) in enumerate(searches):
+            by_handler.setdefault(handler, []).append((i, body))
+        rv = [None] * len(searches)
+        for handler, indexed_bodies in by_handler.items():
+            indexes, bodies = zip(*indexed_bodies)
+            for i, result in zip(indexes, handler.search_many(list(bodies), **kwargs)):
+                rv[i] = result
+        return rv
+
+    def export(self, body, export_format=DbHelper.EXPORT_NDJSON, exclude_fields=None, include_fields=None, **kwargs):
+        chunks = self.helper.export_helper(body, export_format=export_format, exclude_fields=exclude_fields,
+                                           include_fields=include_fields, **kwargs)
+        return current_app.response_class(
+            stream_with_context(chunks), mimetype=self.helper.EXPORT_MIMETYPES[export_format],
+        )
+
     def search_summary(self, body):
         return self.helper.query_search_helper(body, summary=True)
 
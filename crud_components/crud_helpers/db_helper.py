@@ -1,27 +1,126 @@
 import base64
+import copy
+import csv
+import io
 import itertools
 import json
-from flask import current_app as app
+import time
+from decimal import Decimal
+from flask import current_app as app, g, has_app_context
 from Crypto.Hash import MD5
 from connexion import ProblemException, NoContent
 from flask import current_app
 from itsdangerous import JSONWebSignatureSerializer, BadSignature
-from ..database import UserFilters, UidMixin, make_search_queries
+import sqlalchemy as sa
+from sqlalchemy import orm
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from ..database import UserFilters, UidMixin, LoaderPlan, make_search_queries, make_ids_query, WINDOW_TOTAL_LABEL
+from ..utils import LruCache, Uid, get_uid_codec
+from ..exceptions import ModelValidationError
+from ..model_extensions import Stage
 from .model_visitor import ModelReadVisitor, ModelWriteVisitor
+from .search_count import CountStrategy, estimate_count
+from .search_cache import SearchResponseCache
 
 
 class DbHelper:
 
+    PAGINATION_OFFSET = 'offset'
+    PAGINATION_KEYSET = 'keyset'
+
     def __init__(self, logger, db, **kwargs):
         self.model_cls = kwargs.pop('model_cls')
         self.logger = logger
         self.db = db
         self.read_visitor = kwargs.pop('read_visitor', ModelReadVisitor)
         self.write_visitor = kwargs.pop('write_visitor', ModelWriteVisitor)
+        self.pagination_mode = kwargs.pop('pagination_mode', self.PAGINATION_OFFSET)
+        self.count_strategy = CountStrategy(kwargs.pop('count_strategy', CountStrategy.EXACT))
+        count_cache_ttl = kwargs.pop('count_cache_ttl', 60)
+        self.count_cache = kwargs.pop('count_cache', None) or LruCache(maxsize=1024, ttl=count_cache_ttl)
+        # Optional SearchStatementCache, reusing the search queries of filters with the same shape
+        self.statement_cache = kwargs.pop('statement_cache', None)
+        # Eagerly load the references that are going to be read (see LoaderPlan)
+        self.eager_load = kwargs.pop('eager_load', True)
+        # Only load the columns of the fields that are going to be read (requires eager_load)
+        self.project_columns = kwargs.pop('project_columns', True)
+        # Number of instances written per flush by the bulk operations
+        self.bulk_chunk_size = kwargs.pop('bulk_chunk_size', 500)
+        # Number of rows fetched and serialized at a time by the exports
+        self.export_chunk_size = kwargs.pop('export_chunk_size', 1000)
+        # Optional (scoped) session bound to a read-only replica, used by the searches, reads and exports
+        self.read_session = kwargs.pop('read_session', None)
+        # Seconds during which the reads of a request context stay on the primary after a write
+        self.read_your_writes_window = kwargs.pop('read_your_writes_window', 5)
+        # Optional SearchResponseCache, invalidated when the tables of the model are written.
+        # Only the searches reading the primary are cached (see read_session)
+        self.response_cache = kwargs.pop('response_cache', None)
+        if self.response_cache is not None:
+            self.response_cache.register(self.db.session)
+        # Optional SingleFlight, coalescing the identical searches running at the same time
+        self.single_flight = kwargs.pop('single_flight', None)
+
+    #: Attribute of flask.g holding the time of the last write of the request context
+    LAST_WRITE_ATTRIBUTE = 'crud_components_last_write'
+
+    def mark_write(self):
+        """
+        Keeps the reads of the request context on the primary for `read_your_writes_window` seconds
+        """
+        if has_app_context():
+            setattr(g, self.LAST_WRITE_ATTRIBUTE, time.monotonic())
+
+    def record_written_tables(self, tables):
+        """
+        Records the tables written without the unit of work (e.g. bulk statements), for the response cache
+        """
+        self.db.session.info.setdefault(SearchResponseCache.WRITTEN_TABLES, set()).update(t.name for t in tables)
+
+    def read_db_session(self):
+        """
+        :return: the session the reads should use: the read-only one, unless the request context wrote recently
+        """
+        if self.read_session is None:
+            return self.db.session
+        primary = self.db.session
+        if primary.new or primary.dirty or primary.deleted:
+            return primary
+        last_write = getattr(g, self.LAST_WRITE_ATTRIBUTE, None) if has_app_context() else None
+        if last_write is not None and time.monotonic() - last_write < self.read_your_writes_window:
+            return primary
+        session = self.read_session
+        return session() if isinstance(session, orm.scoped_session) else session
 
     def query_search_helper(self, body, summary=False, exclude_fields=None, include_fields=None, **kwargs):
+        # A session with uncommitted writes must see them, it cannot share the search of another one.
+        # Neither can a request context reading its recent writes on the primary, the others may read the replica.
+        if self.single_flight is None or SearchResponseCache.has_uncommitted_writes(self.db.session) \
+                or (self.read_session is not None and self.read_db_session() is self.db.session):
+            return self._query_search(body, summary, exclude_fields, include_fields, **kwargs)
+
+        # The count memo of query_search_many does not change the response, and its keys are not strings
+        key_kwargs = {k: v for k, v in kwargs.items() if k != 'count_memo'}
+        key = json.dumps(dict(
+            model=self.model_cls.__name__, body=body, summary=summary,
+            exclude_fields=exclude_fields, include_fields=include_fields, kwargs=key_kwargs,
+        ), sort_keys=True, default=repr)
+        (output, code), _ = self.single_flight.do(
+            key, lambda: self._query_search(body, summary, exclude_fields, include_fields, **kwargs)
+        )
+        # The response is shared by all the callers, each of them gets its own copy
+        return copy.deepcopy(output), code
+
+    def _query_search(self, body, summary=False, exclude_fields=None, include_fields=None, **kwargs):
         with_extensions = kwargs.pop('with_extensions', None)
         custom_filter = kwargs.pop('custom_filter', None)
+        pagination_mode = kwargs.pop('pagination_mode', self.pagination_mode)
+        # Totals already counted for the same filters, shared by the searches of query_search_many
+        count_memo = kwargs.pop('count_memo', None)
+        session = self.read_db_session()
+        # The strategy of the request wins over the one of the model, which wins over the one of the helper
+        count_strategy = CountStrategy(
+            kwargs.pop('count_strategy', None) or self.model_cls.crud_metadata.count_strategy or self.count_strategy
+        )
 
         body = body or dict()
         count = body.get("count", app.config['DEFAULT_COUNT'])
@@ -45,7 +144,13 @@ class DbHelper:
         key = current_app.config['SEARCH_KEY']
         serializer = JSONWebSignatureSerializer(key)
 
+        # In keyset mode, the next page is found by seeking after the sort key of the last row of the previous page
+        # Jumping to a page, or a sort key that cannot be compared, goes through the (slower) offset
+        keyset = filters.get_keyset() if pagination_mode == self.PAGINATION_KEYSET else None
+        after_key = None
+
         offset = 0
+        current_token_payload = None
         if current_token:
             try:
                 current_token_payload = serializer.loads(current_token)
@@ -53,18 +158,45 @@ class DbHelper:
                 self.logger.warning("Bad signature")
                 raise ProblemException(title='Invalid request', detail="Bad pagination token")
             self.logger.debug('payload=%r identity=%r', current_token_payload, identity)
-            if identity == current_token_payload.get('identity'):
+            if identity != current_token_payload.get('identity'):
+                current_token_payload = None
+            else:
                 offset = current_token_payload.get('offset', 0)
                 if current_page is not None:
                     offset = (current_page - 1) * count
+                elif keyset is not None:
+                    after_key = filters.load_keyset_values(keyset, current_token_payload.get('last_key'))
         else:
             self.logger.debug('payload=%r identity=%r', None, identity)
 
+        # The responses read from the replica are not cached: it may lag behind a commit that already invalidated them
+        response_key = None
+        if self.response_cache is not None and session is self.db.session \
+                and not self.response_cache.has_uncommitted_writes(self.db.session):
+            response_key = self.response_cache.key(self.model_cls, json.dumps(dict(
+                identity=identity, offset=offset, count=count, page=current_page, token=current_token_payload,
+                count_strategy=count_strategy.value, pagination_mode=pagination_mode,
+                exclude_fields=exclude_fields, include_fields=include_fields, with_extensions=with_extensions,
+            ), sort_keys=True, default=repr))
+            output = self.response_cache.get(response_key)
+            if output is not None:
+                return output, 200
+
+        # Single references are loaded with selectinload too, joinedload does not mix well with LIMIT and UNION
+        loader_plan = LoaderPlan(
+            self.model_cls, field_names, summary=summary, exclude=exclude_fields, include=include_fields,
+            single='selectin', project_columns=self.project_columns,
+        ) if self.eager_load else None
+
+        total, total_strategy = None, None
         while True:
+            # The window total is not the total of the search when seeking or including rows
+            with_window_total = count_strategy is CountStrategy.WINDOW and after_key is None and not filters.include
             try:
                 query, total_query, has_extra = self.make_search_queries(
                     self.model_cls, filters, count + 1, offset, field_names,
-                    with_extra_columns=True
+                    with_extra_columns=True, keyset=keyset, after_key=after_key, with_window_total=with_window_total,
+                    loader_plan=loader_plan, session=session,
                 )
             except ValueError:
                 self.logger.debug("Problem in the order", exc_info=True)
@@ -76,39 +208,54 @@ class DbHelper:
             # If we had access to the cursor, we could ask for rowcount before we iterate over the results
             query_results = query.all()
 
-            # Get the total and page calculations in case we need to go "backwards" in the query
-            total = total_query.scalar()
-            pages, remainder = divmod(total, count)
-            last_page = pages + (1 if remainder > 0 else 0)
+            if with_window_total and (query_results or offset == 0):
+                # Every row carries the total; an empty first page means there are no results at all
+                total = getattr(query_results[0], WINDOW_TOTAL_LABEL) if query_results else 0
+                total_strategy = CountStrategy.WINDOW
+            has_extra = has_extra or with_window_total
 
             if offset == 0 or len(query_results) > 0:
                 # We have some valid data (i.e. a valid offset was requested)
                 # Break out of the loop and render them
                 break
 
+            # Get the total and page calculations since we need to go "backwards" in the query
+            # Whatever the count strategy, this needs the exact number
+            total, total_strategy = total_query.scalar(), CountStrategy.EXACT
+            pages, remainder = divmod(total, count)
+            last_page = pages + (1 if remainder > 0 else 0)
+
             # We got a request for a page that is out of bounds, go back to the last page and return that
-            offset = (last_page - 1) * count
+            # (using the offset, there is no sort key to seek after)
+            offset = max(last_page - 1, 0) * count
+            after_key = None
+
+        if total_strategy is None:
+            total, total_strategy = self.count_total(
+                count_strategy, total_query, identity, current_token_payload,
+                count_memo=count_memo, count_key=repr(filters),
+            )
 
         iquery = iter(query_results)
         last_result = None
 
-        r_visitor = self.read_visitor(session=self.db.session, with_extensions=with_extensions)
-        results = []
+        r_visitor = self.read_visitor(session=session, with_extensions=with_extensions)
+        rows = list(itertools.islice(iquery, count))
+        page = [r[0] for r in rows] if has_extra else rows
+        if page:
+            last_result = page[-1]
+        # Visited as a page, batched extension fields are exposed once for all the instances
+        results = r_visitor.visit_models(page, field_names=field_names, summary=summary, exclude=exclude_fields, include=include_fields)
         if has_extra:
-            for r in itertools.islice(iquery, count):
-                last_result = r[0]
-                d = r_visitor.visit_model(r[0], field_names=field_names, summary=summary, exclude=exclude_fields, include=include_fields)
+            for r, d in zip(rows, results):
                 extra = r._asdict()
                 v = extra.pop(r.keys()[0])
                 assert v is r[0], "We were assuming the result object is an ordered dict"
+                extra.pop(WINDOW_TOTAL_LABEL, None)
                 d.update(extra)
-                results.append(d)
-        else:
-            for r in itertools.islice(iquery, count):
-                last_result = r
-                d = r_visitor.visit_model(r, field_names=field_names, summary=summary, exclude=exclude_fields, include=include_fields)
-                results.append(d)
         next_result = next(iquery, None)
+        if has_extra and next_result is not None:
+            next_result = next_result[0]
 
         if next_result is not None:
             next_token_payload = dict(
@@ -122,6 +269,10 @@ class DbHelper:
                 last_id=last_result.uid if isinstance(last_result, UidMixin) else None,
                 offset=(offset + count) if last_result else offset,
             )
+        if keyset is not None and last_result is not None:
+            next_token_payload['last_key'] = filters.dump_keyset_values(keyset, last_result)
+        if count_strategy is CountStrategy.CARRY and total is not None:
+            next_token_payload['total'] = total
         next_token = serializer.dumps(next_token_payload, header_fields={'v': 1}).decode('ascii')
 
         output = dict(
@@ -131,21 +282,236 @@ class DbHelper:
                 count=len(results),
                 offset=offset + 1,
                 total=total,
+                totalStrategy=total_strategy.value,
                 more=bool(next_result is not None),
                 page=offset//count + 1,
             ),
         )
+        if response_key is not None:
+            self.response_cache.set(response_key, output)
         return output, 200
 
-    def make_search_queries(self, model_cls, filters, count, offset, field_names, with_extra_columns=True):
-        return make_search_queries(model_cls, filters, count, offset, field_names, with_extra_columns=with_extra_columns)
+    def query_search_many(self, bodies, summary=False, exclude_fields=None, include_fields=None, **kwargs):
+        """
+        Runs many searches, counting the exact totals of their distinct filters in a single statement
+        :param bodies: a list of search bodies
+        :return: the list of (output, code), in the order of the bodies
+        """
+        count_memo = dict()
+        self._count_many(bodies, count_memo, **kwargs)
+        outputs = dict()
+        rv = []
+        for body in bodies:
+            key = json.dumps(body or dict(), sort_keys=True, default=repr)
+            if key not in outputs:
+                outputs[key] = self.query_search_helper(
+                    body, summary=summary, exclude_fields=exclude_fields, include_fields=include_fields,
+                    count_memo=count_memo, **kwargs
+                )
+                rv.append(outputs[key])
+            else:
+                output, code = outputs[key]
+                rv.append((copy.deepcopy(output), code))
+        return rv
+
+    def _count_many(self, bodies, count_memo, **kwargs):
+        """
+        Counts the exact totals of the distinct filters of many searches into `count_memo` (see count_total)
+        """
+        count_strategy = CountStrategy(
+            kwargs.get('count_strategy') or self.model_cls.crud_metadata.count_strategy or self.count_strategy
+        )
+        if count_strategy is not CountStrategy.EXACT:
+            # The other strategies may not need to count at all
+            return
+        custom_filter = kwargs.get('custom_filter')
+        counts = dict()
+        for body in bodies:
+            body = body or dict()
+            try:
+                filters = UserFilters(
+                    self.model_cls, custom_filter,
+                    filter=body.get("filter"), order=body.get("order"), term=body.get("term"),
+                    include=body.get("include"), exclude=body.get("exclude"),
+                )
+            except ProblemException:
+                # Reported by the search itself
+                continue
+            count_key = repr(filters)
+            if count_key in counts:
+                continue
+            field_names = body.get("fields")
+            field_names = tuple(sorted(f for f in field_names if f and f.strip())) if field_names else tuple()
+            try:
+                # The same count query as the search, with its joins and included rows
+                _, total_query, _ = make_search_queries(self.model_cls, filters, None, None, field_names)
+            except ValueError:
+                continue
+            counts[count_key] = total_query.statement
+        if len(counts) < 2:
+            return
+
+        # SELECT (SELECT count(...) ...), (SELECT count(...) ...), ...
+        statement = sa.select([stmt.as_scalar().label('total_{}'.format(i)) for i, stmt in enumerate(counts.values())])
+        totals = self.read_db_session().execute(statement).first()
+        for count_key, total in zip(counts.keys(), totals):
+            count_memo[CountStrategy.EXACT, count_key] = total, CountStrategy.EXACT
+
+    EXPORT_NDJSON = 'ndjson'
+    EXPORT_CSV = 'csv'
+    EXPORT_MIMETYPES = {
+        EXPORT_NDJSON: 'application/x-ndjson',
+        EXPORT_CSV: 'text/csv',
+    }
+
+    def export_helper(self, body, export_format=EXPORT_NDJSON, summary=False, exclude_fields=None, include_fields=None,
+                      **kwargs):
+        """
+        Exports all the results of a search, streaming them from a server-side cursor
+        :param body: a search body, without pagination
+        :param export_format: EXPORT_NDJSON or EXPORT_CSV
+        :return: a generator of bytes
+        """
+        with_extensions = kwargs.pop('with_extensions', None)
+        custom_filter = kwargs.pop('custom_filter', None)
+        chunk_size = kwargs.pop('chunk_size', self.export_chunk_size)
+        if export_format not in self.EXPORT_MIMETYPES:
+            raise ProblemException(title='Invalid request', detail="Unknown export format {!r}".format(export_format))
+
+        body = body or dict()
+        filters = UserFilters(
+            self.model_cls, custom_filter,
+            filter=body.get("filter"), order=body.get("order"), term=body.get("term"), exclude=body.get("exclude"),
+        )
+        field_names = body.get("fields")
+        field_names = tuple(sorted(f for f in field_names if f and f.strip())) if field_names else tuple()
+
+        # joinedload cannot be used with yield_per, selectinload loads the references of each chunk
+        loader_plan = LoaderPlan(
+            self.model_cls, field_names, summary=summary, exclude=exclude_fields, include=include_fields,
+            single='selectin', project_columns=self.project_columns,
+        ) if self.eager_load else None
+        try:
+            query, _, _ = make_search_queries(
+                self.model_cls, filters, None, None, field_names, with_extra_columns=False, loader_plan=loader_plan,
+            )
+            session = self.read_db_session()
+            if session is not self.db.session:
+                query = query.with_session(session)
+        except ValueError:
+            self.logger.debug("Problem in the order", exc_info=True)
+            raise ProblemException(title='Invalid request', detail="Problem in the requested order")
+
+        def iter_chunks():
+            rows = iter(query.yield_per(chunk_size))
+            while True:
+                chunk = list(itertools.islice(rows, chunk_size))
+                if not chunk:
+                    return
+                # A fresh visitor per chunk, its visited instances and include map do not grow with the export
+                r_visitor = self.read_visitor(session=session, with_extensions=with_extensions)
+                yield r_visitor.visit_models(chunk, field_names=field_names, summary=summary,
+                                             include=include_fields, exclude=exclude_fields)
+
+        if export_format == self.EXPORT_CSV:
+            return self._export_csv(iter_chunks())
+        return self._export_ndjson(iter_chunks())
+
+    @staticmethod
+    def _export_value(value):
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        if isinstance(value, Decimal):
+            return str(value)
+        raise TypeError('{!r} is not JSON serializable'.format(value))
+
+    def _export_ndjson(self, chunks):
+        for chunk in chunks:
+            yield ''.join(
+                json.dumps(dikt, default=self._export_value) + '\n'
+                for dikt in chunk
+            ).encode()
+
+    def _export_csv(self, chunks):
+        writer, buffer = None, io.StringIO()
+        for chunk in chunks:
+            for dikt in chunk:
+                if writer is None:
+                    # The columns are the fields of the first row
+                    writer = csv.DictWriter(buffer, fieldnames=list(dikt.keys()), restval='', extrasaction='ignore')
+                    writer.writeheader()
+                writer.writerow({
+                    k: json.dumps(v, default=self._export_value) if isinstance(v, (dict, list)) else
+                    self._export_value(v) if hasattr(v, 'isoformat') else v
+                    for k, v in dikt.items()
+                })
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+
+    def count_total(self, count_strategy, total_query, identity, current_token_payload=None,
+                    count_memo=None, count_key=None):
+        """
+        Determines the total number of results of a search
+        :param count_memo: the totals already counted, by (strategy, `count_key`)
+        :return: the total (None if not counted) and the strategy that actually produced it
+        """
+        if count_memo is None or count_strategy is CountStrategy.NONE:
+            return self._count_total(count_strategy, total_query, identity, current_token_payload)
+        try:
+            return count_memo[count_strategy, count_key]
+        except KeyError:
+            rv = count_memo[count_strategy, count_key] = self._count_total(
+                count_strategy, total_query, identity, current_token_payload)
+            return rv
+
+    def _count_total(self, count_strategy, total_query, identity, current_token_payload=None):
+        if count_strategy is CountStrategy.NONE:
+            return None, count_strategy
+        elif count_strategy is CountStrategy.CARRY:
+            total = current_token_payload.get('total') if current_token_payload else None
+            if total is not None:
+                return total, count_strategy
+        elif count_strategy is CountStrategy.CACHED:
+            total = self.count_cache.get(identity)
+            if total is None:
+                total = total_query.scalar()
+                self.count_cache.set(identity, total)
+            return total, count_strategy
+        elif count_strategy is CountStrategy.ESTIMATED:
+            total = estimate_count(total_query.session, total_query)
+            if total is not None:
+                return total, count_strategy
+        return total_query.scalar(), CountStrategy.EXACT
+
+    def make_search_queries(self, model_cls, filters, count, offset, field_names, with_extra_columns=True,
+                            keyset=None, after_key=None, with_window_total=False, loader_plan=None, session=None):
+        if self.statement_cache is not None:
+            session = session if session is not None else self.db.session
+            if isinstance(session, orm.scoped_session):
+                # Baked queries need the session itself, not its registry
+                session = session()
+            return self.statement_cache.make_search_queries(
+                session, model_cls, filters, count, offset, field_names,
+                with_extra_columns=with_extra_columns, keyset=keyset, after_key=after_key,
+                with_window_total=with_window_total, loader_plan=loader_plan,
+            )
+        query, total_query, has_extra = make_search_queries(
+            model_cls, filters, count, offset, field_names, with_extra_columns=with_extra_columns,
+            keyset=keyset, after_key=after_key, with_window_total=with_window_total, loader_plan=loader_plan,
+        )
+        if session is not None and session is not self.db.session:
+            query, total_query = query.with_session(session), total_query.with_session(session)
+        return query, total_query, has_extra
 
     def create_helper(self, body, **kwargs):
+        self.mark_write()
         only_field_names = kwargs.pop('only_field_names', None)
         with_whitelist_args = kwargs.pop('with_whitelist_args', None)
         with_extensions = kwargs.pop('with_extensions', None)
 
         w_visitor = self.write_visitor(session=self.db.session, with_whitelist_args=with_whitelist_args, with_extensions=with_extensions)
+        w_visitor.prefetch_references(self.model_cls.crud_metadata, [body], creating=True, only_field_names=only_field_names)
         model_ins = self.model_cls.create()
         self.db.session.add(model_ins)
         model_ins, _ = w_visitor.visit_model(model_ins, body, creating=True, only_field_names=only_field_names)
@@ -159,20 +525,280 @@ class DbHelper:
         jsonable_dict = r_visitor.visit_model(model_ins)
         return jsonable_dict, 201
 
+    def bulk_create_helper(self, body, **kwargs):
+        self.mark_write()
+        only_field_names = kwargs.pop('only_field_names', None)
+        with_whitelist_args = kwargs.pop('with_whitelist_args', None)
+        with_extensions = kwargs.pop('with_extensions', None)
+        chunk_size = kwargs.pop('chunk_size', self.bulk_chunk_size)
+
+        creates = body.get("creates", [])
+
+        model_instances = self._bulk_create(creates, only_field_names, with_whitelist_args, with_extensions, chunk_size)
+
+        results = self.read_visitor(session=self.db.session, with_extensions=with_extensions).visit_models(model_instances)
+        return dict(results=results), 201
+
+    def _bulk_create(self, bodies, only_field_names=None, with_whitelist_args=None, with_extensions=None,
+                     chunk_size=None):
+        """
+        Creates many instances, flushing once per chunk
+        :param bodies: a list of bodies
+        :return: the list of created instances, in the order of the bodies
+        """
+        chunk_size = chunk_size or len(bodies) or 1
+        created = []
+        for start in range(0, len(bodies), chunk_size):
+            chunk = bodies[start:start + chunk_size]
+            ids = self.model_cls.reserve_ids(self.db.session, len(chunk))
+
+            # A single visitor queues the executions of the whole chunk, they run stage by stage
+            w_visitor = self.write_visitor(session=self.db.session, with_whitelist_args=with_whitelist_args, with_extensions=with_extensions)
+            w_visitor.prefetch_references(self.model_cls.crud_metadata, chunk, creating=True, only_field_names=only_field_names)
+            model_instances = []
+            for i, body in enumerate(chunk):
+                model_ins = self.model_cls.create()
+                if ids is not None:
+                    model_ins.id = ids[i]
+                self.db.session.add(model_ins)
+                model_ins, _ = w_visitor.visit_model(model_ins, body, creating=True, only_field_names=only_field_names)
+                model_instances.append(model_ins)
+            self.model_cls.assert_uniqueness_many(model_instances)
+            w_visitor.pre_flush()
+            self.db.session.flush()
+            w_visitor.post_flush()
+            self.db.session.flush()
+
+            created.extend(model_instances)
+        return created
+
+    def upsert_helper(self, body, **kwargs):
+        self.mark_write()
+        only_field_names = kwargs.pop('only_field_names', None)
+        with_whitelist_args = kwargs.pop('with_whitelist_args', None)
+        with_extensions = kwargs.pop('with_extensions', None)
+        chunk_size = kwargs.pop('chunk_size', self.bulk_chunk_size)
+        key_names = tuple(kwargs.pop('upsert_key', None) or self.upsert_key())
+
+        upserts = body.get("upserts", [])
+
+        inserted, updated = 0, 0
+        chunk_size = chunk_size or len(upserts) or 1
+        for start in range(0, len(upserts), chunk_size):
+            chunk = upserts[start:start + chunk_size]
+            rows = self._upsert_rows(chunk, key_names, only_field_names, with_whitelist_args)
+            if rows is not None:
+                chunk_inserted, chunk_updated = self._upsert_in_bulk(rows, key_names)
+            else:
+                chunk_inserted, chunk_updated = self._upsert_in_chunk(
+                    chunk, key_names, only_field_names, with_whitelist_args, with_extensions)
+            inserted += chunk_inserted
+            updated += chunk_updated
+        return dict(inserted=inserted, updated=updated), 200
+
+    def upsert_key(self):
+        """
+        The exposed names of the fields identifying the rows of an upsert: CrudMetadata.upsert_key if declared,
+        the first unique field otherwise
+        """
+        crud_metadata = self.model_cls.crud_metadata
+        if crud_metadata.upsert_key:
+            return crud_metadata.upsert_key
+        for f in crud_metadata.fields_with('unique_column'):
+            if f.exposed and not f.generated:
+                return f.exposed_name,
+        raise ProblemException(title='Invalid request', detail="No field identifies the rows to upsert")
+
+    def _upsert_rows(self, bodies, key_names, only_field_names=None, with_whitelist_args=None):
+        """
+        Converts the bodies to rows of the table, through the same whitelist as the write visitor
+        :return: a list of {column key: value}, or None if they cannot be written without the unit of work
+        """
+        mapper = sa.inspect(self.model_cls)
+        crud_metadata = self.model_cls.crud_metadata
+        if self.db.session.get_bind(mapper).dialect.name != 'postgresql' or len(mapper.tables) > 1:
+            return None
+        if any(crud_metadata.model_executions[stage] for stage in (Stage.PRE_FLUSH, Stage.POST_FLUSH)):
+            return None
+
+        key_col_keys = [mapper.columns[crud_metadata.find_field_by_exposed_name(k).internal_name].key for k in key_names]
+        with_executions = {f.internal_name for f in crud_metadata.fields_with('executions')}
+        rows = []
+        for body in bodies:
+            row = dict()
+            iter_whitelist = self.write_visitor.whitelist(
+                crud_metadata, body, True, only_field_names, **(with_whitelist_args or dict())
+            )
+            for name, field, value, _ in iter_whitelist:
+                if field is None:
+                    continue
+                if field.attr_type != 'column' or isinstance(field.exposed_as, str) \
+                        or field.internal_name in with_executions:
+                    # References, extensions, executions... need the write visitor
+                    return None
+                col = mapper.columns[field.internal_name]
+                if callable(field.unexposed_as):
+                    value = field.unexposed_as(None, field, value)
+                row[col.key] = value
+            if any(k not in row for k in key_col_keys):
+                raise ModelValidationError("Missing {} in upsert".format(', '.join(key_names)))
+            rows.append(row)
+        return rows
+
+    def _upsert_in_bulk(self, rows, key_names):
+        """
+        Upserts with INSERT ... ON CONFLICT DO UPDATE, one statement per set of columns
+        :return: the numbers of inserted and updated rows
+        """
+        session = self.db.session
+        table = sa.inspect(self.model_cls).local_table
+        statements = self._upsert_statements(rows, key_names)
+
+        # Nothing pending must be applied after the upsert
+        session.flush()
+        self.record_written_tables([table])
+        inserted, updated, ids = 0, 0, set()
+        for stmt in statements:
+            for pkey, was_inserted in session.execute(stmt):
+                ids.add(pkey)
+                if was_inserted:
+                    inserted += 1
+                else:
+                    updated += 1
+
+        for instance in list(session.identity_map.values()):
+            if isinstance(instance, self.model_cls) and instance.id in ids:
+                session.expire(instance)
+        return inserted, updated
+
+    def _upsert_statements(self, rows, key_names):
+        """
+        :return: the INSERT ... ON CONFLICT DO UPDATE ... RETURNING statements of the rows
+        """
+        mapper = sa.inspect(self.model_cls)
+        table = mapper.local_table
+        crud_metadata = self.model_cls.crud_metadata
+        key_cols = [mapper.columns[crud_metadata.find_field_by_exposed_name(k).internal_name] for k in key_names]
+
+        # The rows that already exist are updated like an update would: the uneditable fields are left alone
+        uneditable = {
+            mapper.columns[f.internal_name].key
+            for f in crud_metadata.fields_with('uneditable_column')
+        }
+        key_col_keys = {col.key for col in key_cols}
+
+        keys = set()
+        groups = dict()
+        for row in rows:
+            key = tuple(row[col.key] for col in key_cols)
+            if key in keys:
+                raise ModelValidationError("Field {} is not unique".format(', '.join(key_names)))
+            keys.add(key)
+            groups.setdefault(frozenset(row.keys()), []).append(row)
+
+        # The unit of work does not apply the onupdate of the columns here
+        onupdates = dict()
+        for col in table.columns:
+            default = col.onupdate
+            if default is None or default.is_sequence:
+                continue
+            onupdates[col.key] = default.arg(None) if default.is_callable else default.arg
+
+        statements = []
+        for col_keys, group_rows in groups.items():
+            stmt = pg_insert(table).values(group_rows)
+            set_ = {k: stmt.excluded[k] for k in col_keys if k not in key_col_keys and k not in uneditable}
+            set_.update((k, v) for k, v in onupdates.items() if k not in set_)
+            if not set_:
+                # Still update, otherwise the existing rows are not returned
+                set_ = {col.key: stmt.excluded[col.key] for col in key_cols}
+            statements.append(stmt.on_conflict_do_update(index_elements=key_cols, set_=set_).returning(
+                table.c.id, sa.literal_column('xmax = 0', sa.Boolean).label('inserted'),
+            ))
+        return statements
+
+    def _upsert_in_chunk(self, bodies, key_names, only_field_names=None, with_whitelist_args=None,
+                         with_extensions=None):
+        """
+        Upserts through the write visitor: the existing instances are found with a single query
+        :return: the numbers of inserted and updated instances
+        """
+        crud_metadata = self.model_cls.crud_metadata
+        key_fields = [crud_metadata.find_field_by_exposed_name(k) for k in key_names]
+        key_attrs = [getattr(self.model_cls, f.internal_name) for f in key_fields]
+
+        keys = []
+        for body in bodies:
+            try:
+                keys.append(tuple(body[k] for k in key_names))
+            except KeyError:
+                raise ModelValidationError("Missing {} in upsert".format(', '.join(key_names)))
+        if len(set(keys)) != len(keys):
+            raise ModelValidationError("Field {} is not unique".format(', '.join(key_names)))
+
+        unexposed_keys = [
+            tuple(f.unexposed_as(None, f, v) if callable(f.unexposed_as) else v for f, v in zip(key_fields, key))
+            for key in keys
+        ]
+        criterion = sa.tuple_(*key_attrs).in_(unexposed_keys) if len(key_attrs) > 1 else key_attrs[0].in_(
+            [key for key, in unexposed_keys])
+        existing = {
+            tuple(getattr(model_ins, f.internal_name) for f in key_fields): model_ins
+            for model_ins in self.model_cls.query.filter(criterion)
+        }
+
+        w_visitor = self.write_visitor(session=self.db.session, with_whitelist_args=with_whitelist_args, with_extensions=with_extensions)
+        for creating in (True, False):
+            chunk = [body for key, body in zip(unexposed_keys, bodies) if (key in existing) is not creating]
+            if chunk:
+                w_visitor.prefetch_references(crud_metadata, chunk, creating=creating, only_field_names=only_field_names)
+        model_instances, inserted, updated = [], 0, 0
+        for key, body in zip(unexposed_keys, bodies):
+            model_ins = existing.get(key)
+            creating = model_ins is None
+            if creating:
+                model_ins = self.model_cls.create()
+                self.db.session.add(model_ins)
+                inserted += 1
+            else:
+                updated += 1
+            model_ins, _ = w_visitor.visit_model(model_ins, body, creating=creating, only_field_names=only_field_names)
+            model_instances.append(model_ins)
+        self.model_cls.assert_uniqueness_many(model_instances)
+        w_visitor.pre_flush()
+        self.db.session.flush()
+        w_visitor.post_flush()
+        self.db.session.flush()
+        return inserted, updated
+
     def get_helper(self, uid_str, field_names, include_fields=None, exclude_fields=None, **kwargs):
         summary = kwargs.pop('summary', False)
         with_extensions = kwargs.pop('with_extensions', None)
 
-        model_ins = self.model_cls.find(uid_str)
+        field_names = tuple(sorted(f for f in field_names if f and f.strip())) if field_names else tuple()
+        if self.eager_load:
+            loader_plan = LoaderPlan(
+                self.model_cls, field_names, summary=summary, exclude=exclude_fields, include=include_fields,
+                project_columns=self.project_columns,
+            )
+            options = tuple(loader_plan.options())
+        else:
+            options = ()
+        session = self.read_db_session()
+        if session is self.db.session:
+            model_ins = self.model_cls.find(uid_str, options=options)
+        else:
+            pkey_value = self.model_cls.pkey_values([uid_str])[0]
+            model_ins = session.query(self.model_cls).options(*options).get(pkey_value) if pkey_value is not None else None
         if model_ins is None:
             return NoContent, 404
-        field_names = tuple(sorted(f for f in field_names if f and f.strip())) if field_names else tuple()
 
-        r_visitor = self.read_visitor(session=self.db.session, with_extensions=with_extensions)
+        r_visitor = self.read_visitor(session=session, with_extensions=with_extensions)
         jsonable_dict = r_visitor.visit_model(model_ins, field_names=field_names, summary=summary, include=include_fields, exclude=exclude_fields)
         return jsonable_dict, 200
 
     def update_helper(self, uid_str, body, **kwargs):
+        self.mark_write()
         only_field_names = kwargs.pop('only_field_names', None)
         with_whitelist_args = kwargs.pop('with_whitelist_args', None)
         with_extensions = kwargs.pop('with_extensions', None)
@@ -186,21 +812,67 @@ class DbHelper:
         return jsonable_dict, 200
 
     def bulk_update_helper(self, body, **kwargs):
+        self.mark_write()
         only_field_names = kwargs.pop('only_field_names', None)
         with_whitelist_args = kwargs.pop('with_whitelist_args', None)
         with_extensions = kwargs.pop('with_extensions', None)
+        with_results = kwargs.pop('with_results', False)
+        chunk_size = kwargs.pop('chunk_size', self.bulk_chunk_size)
 
         updates = body.get("updates", {})
 
-        total_changes = 0
-        for uid_str, value in updates.items():
-            # TODO the bulk update queries can be optimized
-            model_ins, changes = self._update(uid_str, value, only_field_names, with_whitelist_args, with_extensions)
-            if model_ins is None:
-                return NoContent, 404
+        updated = self._bulk_update(updates, only_field_names, with_whitelist_args, with_extensions, chunk_size)
+        if updated is None:
+            return NoContent, 404
 
-            total_changes += 1 if changes > 0 else 0
-        return dict(changes=total_changes), 200
+        output = dict(changes=sum(1 for _, changes in updated if changes > 0))
+        if with_results:
+            output['results'] = self.read_visitor(session=self.db.session, with_extensions=with_extensions).visit_models(
+                model_ins for model_ins, _ in updated
+            )
+        return output, 200
+
+    def _bulk_update(self, updates, only_field_names=None, with_whitelist_args=None, with_extensions=None,
+                     chunk_size=None):
+        """
+        Updates many instances, loading them with a single query and flushing once per chunk
+        :param updates: a dictionary of uid -> body
+        :return: a list of (instance, changes) in the order of the updates, or None if an instance was not found
+        """
+        uid_strs, bodies = list(updates.keys()), list(updates.values())
+        model_instances = self.model_cls.find_many(uid_strs)
+        if any(model_ins is None for model_ins in model_instances):
+            return None
+
+        chunk_size = chunk_size or len(bodies) or 1
+        updated = []
+        for start in range(0, len(bodies), chunk_size):
+            chunk = list(zip(model_instances[start:start + chunk_size], bodies[start:start + chunk_size]))
+
+            # A single visitor queues the executions of the whole chunk, they run stage by stage
+            w_visitor = self.write_visitor(session=self.db.session, with_whitelist_args=with_whitelist_args, with_extensions=with_extensions)
+            w_visitor.prefetch_references(self.model_cls.crud_metadata, [body for _, body in chunk], creating=False, only_field_names=only_field_names)
+            chunk_changes = [
+                w_visitor.visit_model(model_ins, body, creating=False, only_field_names=only_field_names)
+                for model_ins, body in chunk
+            ]
+            if not any(changes for _, changes in chunk_changes) and not w_visitor.has_post_flush_field_visits \
+                    and not w_visitor.has_queued_executions:
+                # Nothing changed in this chunk and no executions to run: nothing to flush
+                w_visitor.clear()
+                updated.extend(chunk_changes)
+                continue
+            self.model_cls.assert_uniqueness_many(model_ins for model_ins, _ in chunk_changes)
+            w_visitor.pre_flush()
+            self.db.session.flush()
+            w_visitor.post_flush()
+            self.db.session.flush()
+
+            updated.extend(
+                (model_ins, changes + w_visitor.post_flush_changes[model_ins])
+                for model_ins, changes in chunk_changes
+            )
+        return updated
 
     def _update(self, uid_str, body, only_field_names=None, with_whitelist_args=None, with_extensions=None):
         model_ins = self.model_cls.find(uid_str)
@@ -208,7 +880,12 @@ class DbHelper:
             return None, 0
 
         w_visitor = self.write_visitor(session=self.db.session, with_whitelist_args=with_whitelist_args, with_extensions=with_extensions)
+        w_visitor.prefetch_references(self.model_cls.crud_metadata, [body], creating=False, only_field_names=only_field_names)
         model_ins, changes = w_visitor.visit_model(model_ins, body, creating=False, only_field_names=only_field_names)
+        if not changes and not w_visitor.has_post_flush_field_visits and not w_visitor.has_queued_executions:
+            # Nothing changed and no executions to run: nothing to flush
+            w_visitor.clear()
+            return model_ins, 0
         model_ins.assert_uniqueness()
         w_visitor.pre_flush()
         self.db.session.flush()
@@ -218,6 +895,7 @@ class DbHelper:
         return model_ins, changes
 
     def delete_helper(self, uid_str, **kwargs):
+        self.mark_write()
         with_extensions = kwargs.pop('with_extensions', None)
         model_ins = self.model_cls.find(uid_str)
 
@@ -231,6 +909,102 @@ class DbHelper:
 
         return NoContent, 204
 
+    def bulk_delete_ids(self, body, **kwargs):
+        """
+        Selects the rows a bulk delete targets
+        :param body: either `uids`, a list of uids, or `filter` (and `term`, `exclude`) as understood by UserFilters
+        :return: a list of ids, or a statement selecting them
+        """
+        custom_filter = kwargs.pop('custom_filter', None)
+        if body.get('uids') is not None:
+            return [pkey for pkey in self.model_cls.pkey_values(body['uids']) if pkey is not None]
+        if 'filter' not in body:
+            # Deleting everything must at least be asked for with an empty filter
+            raise ProblemException(title='Invalid request', detail="Expected uids or a filter")
+        filters = UserFilters(
+            self.model_cls, custom_filter,
+            filter=body.get("filter"), term=body.get("term"), exclude=body.get("exclude"),
+        )
+        return make_ids_query(self.model_cls, filters)
+
+    def delete_summaries(self, ids):
+        """
+        Lightweight summaries of the rows about to be deleted, for the hooks
+        :param ids: a list of ids
+        :return: a list of dictionaries with the uid (or the id) of each row
+        """
+        prefix = self.model_cls.UID_PREFIX if issubclass(self.model_cls, UidMixin) else None
+        if prefix is None:
+            return [dict(id=pkey) for pkey in ids]
+        uids = get_uid_codec().encode_many(Uid(prefix=prefix, serial_id=pkey, version=0) for pkey in ids)
+        return [dict(uid=uid) for uid in uids]
+
+    def bulk_delete_helper(self, body, ids=None, **kwargs):
+        self.mark_write()
+        with_extensions = kwargs.pop('with_extensions', None)
+        chunk_size = kwargs.pop('chunk_size', self.bulk_chunk_size)
+        if ids is None:
+            ids = self.bulk_delete_ids(body, **kwargs)
+
+        # Nothing pending must be lost by the bulk delete, nor applied after it
+        self.db.session.flush()
+        if self.model_cls.can_delete_in_bulk():
+            deleted = self._delete_in_bulk(ids, chunk_size)
+        else:
+            deleted = self._delete_in_chunks(ids, with_extensions, chunk_size)
+        return dict(deleted=deleted), 200
+
+    def _delete_in_bulk(self, ids, chunk_size=None):
+        """
+        Deletes with a single DELETE statement per chunk of ids (or a single one for a statement selecting them)
+        """
+        session = self.db.session
+        pkey = self.model_cls.id
+        self.record_written_tables(sa.inspect(self.model_cls).tables)
+        if not isinstance(ids, list):
+            deleted = session.query(self.model_cls).filter(pkey.in_(ids)).delete(synchronize_session=False)
+            # We do not know which ones were deleted, the loaded ones are reloaded if still needed
+            for instance in list(session.identity_map.values()):
+                if isinstance(instance, self.model_cls):
+                    session.expire(instance)
+            return deleted
+
+        deleted = 0
+        chunk_size = chunk_size or len(ids) or 1
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            deleted += session.query(self.model_cls).filter(pkey.in_(chunk)).delete(synchronize_session=False)
+        deleted_ids = set(ids)
+        for instance in list(session.identity_map.values()):
+            if isinstance(instance, self.model_cls) and instance.id in deleted_ids:
+                session.expunge(instance)
+        return deleted
+
+    def _delete_in_chunks(self, ids, with_extensions=None, chunk_size=None):
+        """
+        Deletes through the unit of work, loading and flushing one chunk of instances at a time
+        """
+        session = self.db.session
+        if not isinstance(ids, list):
+            ids = [pkey for pkey, in session.execute(ids)]
+
+        deleted = 0
+        chunk_size = chunk_size or len(ids) or 1
+        for start in range(0, len(ids), chunk_size):
+            model_instances = [
+                model_ins
+                for model_ins in self.model_cls.find_many_by_pkey(ids[start:start + chunk_size])
+                if model_ins is not None
+            ]
+            del_visitor = self.write_visitor(session=session, with_extensions=with_extensions)
+            for model_ins in model_instances:
+                session.delete(model_ins)
+                del_visitor.queue_model_execution(model_ins, None)
+            del_visitor.pre_flush_delete()
+            session.flush()
+            deleted += len(model_instances)
+        return deleted
+
     def metadata_helper(self, field_names):
         field_names = tuple(f for f in field_names if f and f.strip()) if field_names else tuple()
         return self.model_cls.crud_metadata.as_dict(field_names), 200
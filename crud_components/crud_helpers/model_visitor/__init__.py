@@ -1,2 +1,2 @@
-from .read_visitor import ModelReadVisitor
+from .read_visitor import ModelReadVisitor, ReadPlan
 from .write_visitor import ModelWriteVisitor
@@ -1,23 +1,75 @@
 import logging
+import operator
 import geoalchemy2 as ga
 from colour import Color
 from sqlalchemy_utils.functions import getdotattr
 from geoalchemy2.shape import to_shape
 from crud_components.exceptions import ModelValidationError
-from crud_components.utils import Jsonifiable
+from crud_components.utils import Jsonifiable, LruCache
 from ...database import BaseModel, SummaryMixin, parse_field_names
 from ...model_extensions import SkipExtension
 
 logger = logging.getLogger(__name__)
 
+# Field types whose column values are sent as they are
+PLAIN_TYPES = frozenset(('integer', 'string', 'number', 'boolean', 'date', 'datetime', 'time', 'enum'))
+
+_NOT_EXPOSED = object()
+
+
+def convert_value(value):
+    if isinstance(value, ga.WKBElement):
+        point = to_shape(value)
+        return dict(longitude=str(point.x), latitude=str(point.y))
+    elif isinstance(value, Jsonifiable):
+        return value.as_jsonable_dict()
+    elif isinstance(value, Color):
+        return value.hex_l
+    return value
+
+
+def field_getter(field):
+    """
+    A function returning the exposed value of a (non-extension) field of an instance
+    """
+    if field.exposed_as is None:
+        path = field.internal_name
+    elif isinstance(field.exposed_as, str):
+        path = field.exposed_as
+    elif callable(field.exposed_as):
+        exposed_as = field.exposed_as
+        return lambda s: exposed_as(s, field)
+    else:
+        raise TypeError('Field exposed_as is expected to be a string or a function')
+    if '.' in path:
+        # getdotattr handles None and lists along the path
+        return lambda s: getdotattr(s, path)
+    return operator.attrgetter(path)
+
+
+class ReadPlan(list):
+    """
+    The (field, sub field names) pairs returned by `parse_field_names`, with their prebuilt visits if any
+    """
+
+    def __init__(self, field_name_pairs, additional_names, visits=None):
+        super().__init__(field_name_pairs)
+        self.additional_names = additional_names
+        self.visits = visits
+
 
 class ModelReadVisitor:
 
+    #: ReadPlan by visitor class, model and requested field names, shared by all visitors
+    read_plans = LruCache(maxsize=1024)
+
     def __init__(self, session, with_extensions=None):
         self.session = session
         self.with_extensions = with_extensions
         self.include_map = {}
         self._visited = set()
+        #: Values of extension fields exposed by `prefetch_extensions`, by (field, instance)
+        self._exposed = {}
 
     def visit_summary(self, instance):
         if instance is None:
@@ -37,13 +89,61 @@ class ModelReadVisitor:
         else:
             return self.visit_model(instance, summary=False)
 
+    def read_plan(self, crud_metadata, field_names=None, exclude=None, include=None):
+        """
+        Same as `parse_field_names`, but cached, with the field visits compiled
+        """
+        key = (
+            type(self), crud_metadata,
+            frozenset(field_names) if field_names else None,
+            frozenset(exclude) if exclude else None,
+            frozenset(include) if include else None,
+        )
+        plan = self.read_plans.get(key)
+        if plan is None:
+            additional_names, field_name_pairs = parse_field_names(
+                crud_metadata, field_names, exclude=exclude, include=include
+            )
+            visits = None
+            if type(self).visit_field is ModelReadVisitor.visit_field \
+                    and type(self).visit_value is ModelReadVisitor.visit_value:
+                visits = tuple(self.compile_field(f, sub_field_names) for f, sub_field_names in field_name_pairs)
+            plan = ReadPlan(field_name_pairs, additional_names, visits)
+            self.read_plans.set(key, plan)
+        return plan
+
+    @staticmethod
+    def compile_field(field, field_names=None):
+        """
+        Prebuilds the visit of a field, equivalent to `visit_field`
+        :return: a function taking the visitor, the dictionary to fill and the instance
+        """
+        if field.extras.get('extension') is not None:
+            # Extension instances are only known per instance
+            def visit(visitor, dikt, instance):
+                visitor.visit_field(dikt, instance, field, field_names=field_names)
+            return visit
+
+        exposed_name = field.exposed_name
+        getter = field_getter(field)
+        if field.type == 'reference':
+            def visit(visitor, dikt, instance):
+                dikt[exposed_name] = visitor.visit_reference(instance, field, getter(instance), field_names)
+        elif field.attr_type == 'column' and field.exposed_as is None and field.type in PLAIN_TYPES:
+            def visit(visitor, dikt, instance):
+                dikt[exposed_name] = getter(instance)
+        else:
+            def visit(visitor, dikt, instance):
+                dikt[exposed_name] = convert_value(getter(instance))
+        return visit
+
     def visit_model(self, instance, field_names=None, summary=False, exclude=None, include=None):
         # include_map is not emptied after visiting the object.
         # Same visitor would save the include_map for more than 1 object.
         include = set(include or []).union(self.include_map.get(type(instance), ([], tuple()))[1] or [])
         if include or exclude:
-            _ , include_field_name_pairs = parse_field_names(instance.crud_metadata, include)
-            _ , exclude_field_name_pairs = parse_field_names(instance.crud_metadata, exclude)
+            include_field_name_pairs = self.read_plan(instance.crud_metadata, include)
+            exclude_field_name_pairs = self.read_plan(instance.crud_metadata, exclude)
             field_name_pairs = [x for x in include_field_name_pairs if x not in exclude_field_name_pairs]
             for f, sub_field_names in field_name_pairs:
                 if f.reference_kind:
@@ -60,7 +160,9 @@ class ModelReadVisitor:
             return None
 
         include = set(include or []).union(self.include_map.get(type(instance), ([], tuple()))[1] or [])
-        additional_names, field_name_pairs = parse_field_names(instance.crud_metadata, field_names, exclude=exclude, include=include)
+        field_name_pairs = self.read_plan(instance.crud_metadata, field_names, exclude=exclude, include=include)
+        # The plan is shared, each visit consumes its own copy of the names left
+        additional_names = dict(field_name_pairs.additional_names)
 
         # circular reference check
         assert instance not in self._visited, \
@@ -75,6 +177,57 @@ class ModelReadVisitor:
             raise ValueError("Unexpected field names: {}".format(', '.join(map(repr, additional_names.keys()))))
         return dikt
 
+    def visit_models(self, instances, field_names=None, summary=False, exclude=None, include=None):
+        """
+        Same as `visit_model` for a page of instances, exposing their batched extension fields once per field
+        """
+        instances = list(instances)
+        self.prefetch_extensions(instances, field_names=field_names, summary=summary, exclude=exclude, include=include)
+        return [
+            self.visit_model(instance, field_names=field_names, summary=summary, exclude=exclude, include=include)
+            for instance in instances
+        ]
+
+    def prefetch_extensions(self, instances, field_names=None, summary=False, exclude=None, include=None):
+        """
+        Calls `expose_many` of the extensions defining it, once per field for all the instances (not their references)
+        """
+        by_model = dict()
+        for instance in instances:
+            if instance is not None:
+                by_model.setdefault(type(instance), []).append(instance)
+
+        for model_cls, model_instances in by_model.items():
+            crud_metadata = model_cls.crud_metadata
+            if summary:
+                if not issubclass(model_cls, SummaryMixin):
+                    continue
+                fields = crud_metadata.summary_fields
+            else:
+                model_include = set(include or []).union(self.include_map.get(model_cls, ([], tuple()))[1] or [])
+                plan = self.read_plan(crud_metadata, field_names, exclude=exclude, include=model_include)
+                fields = [f for f, _ in plan]
+
+            for field in fields:
+                extension = field.extras.get('extension')
+                if extension is None or extension.expose_many is None:
+                    continue
+                extension_instances, exposed_instances = [], []
+                for instance in model_instances:
+                    try:
+                        extension_instances.append(instance.extension_instance(
+                            extension, self.session, with_extensions=self.with_extensions
+                        ))
+                    except SkipExtension:
+                        # Left to visit_field, which skips it again
+                        continue
+                    exposed_instances.append(instance)
+                if not exposed_instances:
+                    continue
+                values = extension_instances[0].expose_many(exposed_instances, field)
+                for instance, value in zip(exposed_instances, values):
+                    self._exposed[(field, instance)] = value
+
     def visit_model_fields(self, instance, field_name_pairs, additional_names=None):
         return instance.as_dict(self, field_name_pairs, with_extensions=self.with_extensions)
 
@@ -82,33 +235,25 @@ class ModelReadVisitor:
         exposed_name = name or field.exposed_name
         extension = field.extras.get('extension')
         if extension is not None:
+            # Each instance is visited once, the prefetched value is not needed afterwards
+            exposed_value = self._exposed.pop((field, instance), _NOT_EXPOSED)
+            if exposed_value is not _NOT_EXPOSED:
+                dikt[exposed_name] = self.visit_value(instance, field, exposed_value, field_names=field_names)
+                return
             try:
                 extension_instance = instance.extension_instance(extension, self.session, with_extensions=self.with_extensions)
                 expose = extension_instance.expose
             except SkipExtension:
                 return
-        elif field.exposed_as is None:
-            expose = lambda s, f, **kw: getdotattr(s, f.internal_name)
-        elif isinstance(field.exposed_as, str):
-            expose = lambda s, f, **kw: getdotattr(s, f.exposed_as)
-        elif callable(field.exposed_as):
-            expose = field.exposed_as
+            exposed_value = expose(instance, field)
         else:
-            raise TypeError('Field exposed_as is expected to be a string or a function')
-        exposed_value = expose(instance, field)
+            exposed_value = field_getter(field)(instance)
         dikt[exposed_name] = self.visit_value(instance, field, exposed_value, field_names=field_names)
 
     def visit_value(self, instance, field, value, field_names):
         if field.type == 'reference':
             return self.visit_reference(instance, field, value, field_names)
-        elif isinstance(value, ga.WKBElement):
-            point = to_shape(value)
-            return dict(longitude=str(point.x), latitude=str(point.y))
-        elif isinstance(value, Jsonifiable):
-            return value.as_jsonable_dict()
-        elif isinstance(value, Color):
-            return value.hex_l
-        return value
+        return convert_value(value)
 
     def visit_reference(self, instance, field, value, field_names):
         summary = field_names and '_summary' in field_names
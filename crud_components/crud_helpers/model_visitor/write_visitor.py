@@ -1,5 +1,6 @@
 import logging
 from collections import defaultdict, OrderedDict
+from sqlalchemy import inspect
 from sqlalchemy.ext.orderinglist import OrderingList
 from sqlalchemy.orm.attributes import InstrumentedAttribute
 from ...utils import parse_uid
@@ -20,57 +21,34 @@ class ModelWriteVisitor:
         self.with_extensions = with_extensions
         self.with_whitelist_args = with_whitelist_args or dict()
         self._post_flush_field_visits = []
+        #: Changes made by the post flush field visits, by instance
+        self.post_flush_changes = defaultdict(int)
         self._executions = defaultdict(list)
         self._model_executions = defaultdict(list)
         self._nested_visitors = []
+        #: Referenced instances loaded by `prefetch_references`, by (class, id)
+        self._prefetched = parent_visitor._prefetched if parent_visitor is not None else dict()
 
     @staticmethod
     def whitelist(crud_metadata, user_dikt, creating, only_field_names=None,
                   ignore_generated=True, ignore_extra=True, ignore_uneditable=True, keep_extra=False):
         safe_dikt = user_dikt.copy()
-        whitelist = OrderedDict(
-            (f.exposed_name, f)
-            for f in crud_metadata.fields.values()
-            if f.exposed and (creating or f.editable)
-        )
-
-        if only_field_names:
-            field_dotted_names = defaultdict(set)
-            for name in only_field_names:
-                first, *last = name.split('.', 1)
-                if not last:
-                    field_dotted_names[first] = set()
-                elif field_dotted_names[first] is not None:
-                    field_dotted_names[first].add(last[0])
-            field_name_pairs = OrderedDict(
-                (f.exposed_name, (f, field_dotted_names.pop(f.exposed_name)))
-                for f in crud_metadata.fields.values()
-                if f.exposed and f.exposed_name in field_dotted_names
-                )
-            for k in set(whitelist.keys()).difference(field_name_pairs.keys()):
-                del whitelist[k]
-        else:
-            field_dotted_names = None
-            field_name_pairs = OrderedDict(
-                (f.exposed_name, (f, None))
-                for f in whitelist.values()
-            )
-
-        assert not field_dotted_names, 'I think this should always be empty here, it is not user input'
+        plan = crud_metadata.write_plan(creating, only_field_names)
 
-        user_keys = set(user_dikt.keys())
+        user_keys = user_dikt.keys()
+        extra_keys = user_keys - plan.names
         remove_keys = set()
         keep_keys = set()
         if ignore_generated:
-            remove_keys.update(f.exposed_name for f in crud_metadata.fields.values() if f.generated)
+            remove_keys.update(user_keys & plan.generated)
         if ignore_uneditable and not creating:
-            remove_keys.update(f.exposed_name for f in crud_metadata.fields.values() if not f.editable)
+            remove_keys.update(user_keys & plan.uneditable)
         if ignore_extra:
-            remove_keys.update(user_keys.difference(whitelist.keys()))
+            remove_keys.update(extra_keys)
         elif keep_extra:
-            keep_keys.update(user_keys.difference(whitelist.keys()))
+            keep_keys.update(extra_keys)
 
-        forbidden = user_keys.difference(remove_keys).difference(keep_keys).difference(whitelist.keys())
+        forbidden = extra_keys.difference(remove_keys).difference(keep_keys)
         if forbidden:
             # TODO suggest correction of field name or give more details why a field is not available
             raise ModelValidationError("Cannot specify field{} in {!r}: {}".format(
@@ -83,16 +61,59 @@ class ModelWriteVisitor:
             logger.debug("Ignoring keys %r in %r", remove_keys, crud_metadata)
         if keep_keys:
             logger.debug("Keeping extra keys %r in %r", keep_keys, crud_metadata)
-        for k in remove_keys.intersection(user_keys):
+        for k in remove_keys:
             del safe_dikt[k]
 
-        for field_exposed_name, (field, field_names) in field_name_pairs.items():
+        for field_exposed_name, field, field_names in plan.field_name_pairs:
             if field_exposed_name in safe_dikt:
                 yield field_exposed_name, field, safe_dikt.pop(field_exposed_name), field_names
 
         for k in sorted(safe_dikt.keys()):
             yield k, None, safe_dikt[k], None
 
+    def prefetch_references(self, crud_metadata, dikts, creating, only_field_names=None):
+        """
+        Loads the instances referenced by uid in the bodies, with one query per referenced class
+        :param dikts: the bodies that are going to be visited
+        :param creating: whether the visited instances are being created
+        """
+        uids = defaultdict(set)
+        for dikt in dikts:
+            self._collect_reference_uids(uids, crud_metadata, dikt, creating, only_field_names)
+        for field_cls, cls_uids in uids.items():
+            cls_uids = [uid for uid in cls_uids if (field_cls, uid.serial_id) not in self._prefetched]
+            if not cls_uids:
+                continue
+            for uid, instance in zip(cls_uids, field_cls.find_many(cls_uids)):
+                self._prefetched[field_cls, uid.serial_id] = instance
+
+    def _collect_reference_uids(self, uids, crud_metadata, dikt, creating, only_field_names=None):
+        if not crud_metadata.fields_of_type('reference'):
+            return
+        iter_whitelist = self.whitelist(crud_metadata, dikt, creating, only_field_names, **self.with_whitelist_args)
+        for _, field, value, _ in iter_whitelist:
+            if field is None or field.type != 'reference' or not value:
+                continue
+            field_cls = field.reference_to
+            prefix = getattr(field_cls, 'UID_PREFIX', None)
+            for v in (value if field.reference_kind == 'multiple' else (value,)):
+                if not isinstance(v, dict):
+                    continue
+                try:
+                    uid = parse_uid(v.get('uid'))
+                except ValueError:
+                    # Invalid uids are reported by the field visits
+                    continue
+                if uid is not None and prefix is not None and uid.prefix == prefix:
+                    uids[field_cls].add(uid)
+                self._collect_reference_uids(uids, field_cls.crud_metadata, v, uid is None)
+
+    def find_reference(self, field_cls, uid):
+        try:
+            return self._prefetched[field_cls, uid.serial_id]
+        except KeyError:
+            return field_cls.find(uid)
+
     @property
     def check_for_duplicates(self):
         return True
@@ -143,6 +164,23 @@ class ModelWriteVisitor:
             except SkipExtension:
                 continue
 
+    def _run_batched_model_executions(self, stage, pairs):
+        batches = OrderedDict()
+        for instance, value in pairs:
+            for extension in instance.crud_metadata.model_executions[stage]:
+                if not extension.has_batched_executions(stage):
+                    continue
+                try:
+                    extension_instance = instance.extension_instance(extension, self.session, self.with_extensions)
+                except SkipExtension:
+                    continue
+                batch = batches.setdefault(extension, (extension_instance, []))
+                batch[1].append((instance, value))
+        for extension, (extension_instance, extension_pairs) in batches.items():
+            logger.debug('Running batched %s executions of %s for %d instances', stage, extension.__name__,
+                         len(extension_pairs))
+            extension_instance.model_execute_many(self, stage, extension_pairs)
+
     @classmethod
     def _handle_execution_queue(cls, queue, method, stage):
         for instance, *args in queue[stage]:
@@ -150,6 +188,15 @@ class ModelWriteVisitor:
             method(stage, instance, *args)
         queue[stage].clear()
 
+    def _handle_model_execution_queue(self, stage):
+        """
+        Runs the model-level executions of the queued instances, one instance at a time, then the batched ones
+        """
+        pairs = list(self._model_executions[stage])
+        self._handle_execution_queue(self._model_executions, self._run_model_executions, stage)
+        if pairs:
+            self._run_batched_model_executions(stage, pairs)
+
     def add_child(self, child_visitor):
         self._nested_visitors.append(child_visitor)
 
@@ -159,26 +206,37 @@ class ModelWriteVisitor:
             _, change = self.visit_field(instance, field, value, _post_flush=True)
             assert change is not None
             changes += change
+            self.post_flush_changes[instance] += change
         self._post_flush_field_visits.clear()
 
         self._handle_execution_queue(self._executions, self._run_executions, Stage.POST_FLUSH)
-        self._handle_execution_queue(self._model_executions, self._run_model_executions, Stage.POST_FLUSH)
+        self._handle_model_execution_queue(Stage.POST_FLUSH)
 
         return changes
 
+    @property
+    def has_post_flush_field_visits(self):
+        return bool(self._post_flush_field_visits)
+
+    @property
+    def has_queued_executions(self):
+        return any(self._executions.values()) or any(self._model_executions.values())
+
     def pre_flush(self):
         self._handle_execution_queue(self._executions, self._run_executions, Stage.PRE_FLUSH)
-        self._handle_execution_queue(self._model_executions, self._run_model_executions, Stage.PRE_FLUSH)
+        self._handle_model_execution_queue(Stage.PRE_FLUSH)
 
     def pre_flush_delete(self):
         self._handle_execution_queue(self._executions, self._run_executions, Stage.PRE_FLUSH_DELETE)
-        self._handle_execution_queue(self._model_executions, self._run_model_executions, Stage.PRE_FLUSH_DELETE)
+        self._handle_model_execution_queue(Stage.PRE_FLUSH_DELETE)
 
     def clear(self):
         self._post_flush_field_visits.clear()
+        self.post_flush_changes.clear()
         self._executions.clear()
         self._model_executions.clear()
         self._nested_visitors.clear()
+        self._prefetched.clear()
 
     def visit_model(self, instance, dikt, creating, only_field_names=None):
         iter_whitelist = list(self.whitelist(
@@ -222,18 +280,17 @@ class ModelWriteVisitor:
                 attribute_name = field.exposed_as if isinstance(field.exposed_as, str) else field.internal_name
 
                 # assert hasattr(instance, attribute_name)
-                setattr(instance, attribute_name, unexposed_value)
-
-                # force reorder of the children if the collection_class is ordering_list
-                attribute_value = getattr(instance, attribute_name)
-                if isinstance(attribute_value, OrderingList):
-                    attribute_value.reorder()
+                if field.type == 'reference' and field.reference_kind == 'multiple':
+                    set_changed = self.set_collection(instance, attribute_name, unexposed_value)
+                else:
+                    set_changed = self.set_attribute(instance, attribute_name, unexposed_value)
+                changed = (changed or 0) + set_changed
 
             else:
                 unexposed_value, changed = extension_instance.update(instance, field, unexposed_value)
-
-            if changed is None:
-                changed = 0  # TODO determine if it changed
+                if changed is None:
+                    # The extension cannot tell, assume it changed
+                    changed = 1
 
             self.queue_field_execution(instance, field, value)
 
@@ -244,6 +301,53 @@ class ModelWriteVisitor:
             self.queue_post_flush_field_visit(instance, field, value)
             return value, 0
 
+    @staticmethod
+    def set_attribute(instance, attribute_name, value):
+        """
+        Sets an attribute and tells whether it changed, from the attribute history if it is mapped
+        :return: 1 if the attribute changed, 0 otherwise
+        """
+        state = inspect(instance)
+        if attribute_name in state.mapper.attrs:
+            if attribute_name in state.unloaded:
+                # Expired or deferred: load it, the history would not know the value being replaced otherwise
+                getattr(instance, attribute_name)
+            setattr(instance, attribute_name, value)
+            return 1 if state.attrs[attribute_name].history.has_changes() else 0
+        before = getattr(instance, attribute_name, None)
+        setattr(instance, attribute_name, value)
+        after = getattr(instance, attribute_name, None)
+        return 0 if before is after or before == after else 1
+
+    @staticmethod
+    def set_collection(instance, attribute_name, value):
+        """
+        Sets a collection, an ordering_list is only renumbered from the first position that changed
+        :param value: the new list of children
+        :return: 1 if the collection changed, 0 otherwise
+        """
+        old_value = getattr(instance, attribute_name)
+        start = 0
+        if isinstance(old_value, list) and isinstance(value, list):
+            for old_child, child in zip(old_value, value):
+                if old_child is not child:
+                    break
+                start += 1
+            if start == len(old_value) == len(value):
+                return 0
+        # SQLAlchemy only fires the events of the added and removed children
+        setattr(instance, attribute_name, value)
+
+        # force reorder of the children if the collection_class is ordering_list
+        attribute_value = getattr(instance, attribute_name)
+        if isinstance(attribute_value, OrderingList):
+            ordering_attr, ordering_func = attribute_value.ordering_attr, attribute_value.ordering_func
+            for index in range(start, len(attribute_value)):
+                child, position = attribute_value[index], ordering_func(index, attribute_value)
+                if getattr(child, ordering_attr) != position:
+                    setattr(child, ordering_attr, position)
+        return 1
+
     def visit_value(self, instance, field, value):
         if field.type == 'reference':
             rv, changes = self.visit_reference(instance, field, value)
@@ -292,8 +396,14 @@ class ModelWriteVisitor:
     def visit_reference_multiple(self, instance, field, value):
         field_cls = field.reference_to
         if value:
+            # The children already in the collection are neither looked up nor visited again when unchanged
+            current = {
+                child.uid: child
+                for child in getattr(instance, field.internal_name) or ()
+                if getattr(child, 'uid', None) is not None
+            }
             value_list, changes_list = zip(*(
-                self._reference_instance(field, field_cls, v, None)
+                self._reference_child(field, field_cls, v, current)
                 for v in value
                 if v is not None
             ))
@@ -301,6 +411,16 @@ class ModelWriteVisitor:
             value_list, changes_list = tuple(), tuple()
         return list(value_list), sum(changes_list)
 
+    def _reference_child(self, field, field_cls, value, current):
+        uid_str = value.get('uid')
+        old_instance = current.get(uid_str) if current and isinstance(uid_str, str) else None
+        if old_instance is not None and len(value) == 1:
+            value.pop('uid')
+            # Not visited, but its model-level executions run as if it were
+            self.queue_model_execution(old_instance, value)
+            return old_instance, 0
+        return self._reference_instance(field, field_cls, value, old_instance)
+
     def verify_relationship(self, current_side, other_side, field):
         """
         Verifies that you aren't replacing on side of a relationship, between 2 models, by an another model
@@ -356,7 +476,7 @@ class ModelWriteVisitor:
             new_instance, creating = field_cls.create(), True
         elif old_instance is None or uid.serial_id != old_instance.id:
             # We specified a uid (probably among other things)
-            match = field_cls.find(uid)
+            match = self.find_reference(field_cls, uid)
             if match is None:
                 raise ModelValidationError("Invalid uid specified")
             new_instance, creating = match, False
@@ -0,0 +1,165 @@
+import abc
+import copy
+import logging
+import threading
+import sqlalchemy as sa
+from sqlalchemy import orm
+from ..utils import LruCache
+
+logger = logging.getLogger(__name__)
+
+
+class SearchCacheBackend(abc.ABC):
+    """
+    Where SearchResponseCache keeps the responses and the generations of the tables.
+    Subclass it to use an external store (e.g. a shared cache server); values must then be serialized by the backend.
+    The generations must be kept in the same store as the responses: the processes sharing the responses must see
+    the commits of each other.
+    """
+
+    @abc.abstractmethod
+    def get(self, key):
+        """
+        :return: the value stored under `key`, or None
+        """
+
+    @abc.abstractmethod
+    def set(self, key, value, ttl=None):
+        pass
+
+    @abc.abstractmethod
+    def generation(self, name):
+        """
+        :return: the current generation of a table (0 if it never changed)
+        """
+
+    @abc.abstractmethod
+    def bump(self, name):
+        """
+        Increments the generation of a table, making the responses that depend on it unreachable
+        """
+
+
+class LruCacheBackend(SearchCacheBackend):
+    """
+    An in-process backend, with a bounded number of responses that expire after `ttl` seconds.
+    Its generations are only bumped by the commits of this process: with several processes writing, use a shared
+    backend instead.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.responses = LruCache(maxsize=maxsize, ttl=ttl)
+        self._generations = dict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        value = self.responses.get(key)
+        # The responses are mutable dictionaries, do not share them with the callers
+        return copy.deepcopy(value) if value is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.responses.set(key, copy.deepcopy(value), ttl)
+
+    def generation(self, name):
+        return self._generations.get(name, 0)
+
+    def bump(self, name):
+        with self._lock:
+            self._generations[name] = self._generations.get(name, 0) + 1
+
+
+class SearchResponseCache:
+    """
+    Caches search responses by model and request.
+    The responses of a model are invalidated when a transaction that wrote to its table, or to a table it references,
+    is committed (see `register`).
+    """
+
+    #: Key of session.info holding the tables written by the current transaction
+    WRITTEN_TABLES = 'crud_components_written_tables'
+
+    def __init__(self, backend=None, maxsize=1024, ttl=60):
+        self.backend = backend if backend is not None else LruCacheBackend(maxsize=maxsize, ttl=ttl)
+        self._dependencies = dict()
+        self._registered = set()
+
+    def dependencies(self, model_cls):
+        """
+        The names of the tables the responses of a model depend on: its tables and the ones of the models it
+        references, transitively
+        """
+        try:
+            return self._dependencies[model_cls]
+        except KeyError:
+            pass
+        tables, seen, pending = set(), set(), [sa.inspect(model_cls)]
+        while pending:
+            mapper = pending.pop()
+            if mapper in seen:
+                continue
+            seen.add(mapper)
+            tables.update(t.name for t in mapper.tables)
+            for rel in mapper.relationships:
+                if rel.secondary is not None:
+                    tables.add(rel.secondary.name)
+                pending.append(rel.mapper)
+        self._dependencies[model_cls] = rv = tuple(sorted(tables))
+        return rv
+
+    def key(self, model_cls, request_key):
+        """
+        The key of a response, qualified with the current generations of the tables it depends on.
+        Build it before running the search and store the response under it: a commit bumping a generation meanwhile
+        then makes the response unreachable, instead of serving it as the new one.
+        """
+        generations = tuple(self.backend.generation(name) for name in self.dependencies(model_cls))
+        return '{}:{}:{}'.format(model_cls.__name__, request_key, generations)
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def set(self, key, response, ttl=None):
+        self.backend.set(key, response, ttl)
+
+    def invalidate(self, table_names):
+        for name in table_names:
+            logger.debug('Invalidating the search responses depending on %s', name)
+            self.backend.bump(name)
+
+    @classmethod
+    def has_uncommitted_writes(cls, session):
+        """
+        Whether the session wrote something that is not committed yet, its searches must not use the cache
+        """
+        return bool(session.new or session.dirty or session.deleted or session.info.get(cls.WRITTEN_TABLES))
+
+    def register(self, session):
+        """
+        Listens to the writes of a session (or a scoped session, or sessionmaker) to invalidate the cache on commit
+        """
+        if id(session) in self._registered:
+            return
+        self._registered.add(id(session))
+        sa.event.listen(session, 'after_flush', self._after_flush)
+        sa.event.listen(session, 'after_commit', self._after_commit)
+        sa.event.listen(session, 'after_soft_rollback', self._after_soft_rollback)
+
+    def _after_flush(self, session, flush_context):
+        written = session.info.setdefault(self.WRITTEN_TABLES, set())
+        for instance in (*session.new, *session.dirty, *session.deleted):
+            mapper = orm.object_mapper(instance)
+            written.update(t.name for t in mapper.tables)
+            for rel in mapper.relationships:
+                if rel.secondary is not None:
+                    written.add(rel.secondary.name)
+
+    def _after_commit(self, session):
+        if session.transaction is not None and session.transaction.nested:
+            # Savepoints are not visible to the other transactions yet
+            return
+        self.invalidate(session.info.pop(self.WRITTEN_TABLES, ()))
+
+    def _after_soft_rollback(self, session, previous_transaction):
+        # A rolled back savepoint may have written tables the outer transaction wrote too, keep them
+        if previous_transaction.parent is None:
+            session.info.pop(self.WRITTEN_TABLES, None)
@@ -0,0 +1,48 @@
+import json
+import logging
+from enum import Enum
+
+logger = logging.getLogger(__name__)
+
+
+class CountStrategy(Enum):
+    """
+    How the total number of results of a search is determined
+    """
+    #: Run the `COUNT` query on every page
+    EXACT = 'exact'
+    #: Count with `count(*) OVER ()` in the page query itself, in a single round trip
+    WINDOW = 'window'
+    #: Count on the first page, then keep the total in the (signed) pagination token
+    CARRY = 'carry'
+    #: Keep the count of each filter for a while (see `DbHelper.count_cache`)
+    CACHED = 'cached'
+    #: Use the row estimate of the query planner (PostgreSQL only, exact otherwise)
+    ESTIMATED = 'estimated'
+    #: Do not count, the total is not reported (`more` still is)
+    NONE = 'none'
+
+
+def estimate_count(session, query):
+    """
+    Asks the PostgreSQL planner how many rows the count query would count, without running it.
+    :param session: the session to run the EXPLAIN statement on
+    :param query: a count query (as returned by `make_search_queries`)
+    :return: the estimated row count, or None if it cannot be estimated
+    """
+    connection = session.connection()
+    if connection.dialect.name != 'postgresql':
+        return None
+    compiled = query.statement.compile(dialect=connection.dialect)
+    plan = connection.execute('EXPLAIN (FORMAT JSON) {}'.format(compiled), compiled.params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    try:
+        node = plan[0]['Plan']
+        # Skip the count itself, we want the number of rows fed to it
+        while node['Node Type'] == 'Aggregate' and node.get('Plans'):
+            node = node['Plans'][0]
+        return int(node['Plan Rows'])
+    except (IndexError, KeyError, TypeError, ValueError):
+        logger.warning("Unexpected query plan format", exc_info=True)
+        return None
@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import threading
+import weakref
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls: the first caller of a key runs the function, the callers arriving while it
+    is in flight wait for its result instead of running it again.
+    Nothing is kept once the call is over, so no result is served past its in-flight window.
+    """
+
+    def __init__(self, timeout=None):
+        #: Seconds a thread waits for the result of another one, None to wait as long as it takes
+        self.timeout = timeout
+        self._calls = dict()
+        self._lock = threading.Lock()
+        self._async_calls = weakref.WeakKeyDictionary()
+
+    def do(self, key, fn):
+        """
+        Runs `fn` unless a thread is already running it for `key`, then waits for its result
+        :param key: what identifies identical calls
+        :param fn: a function without arguments
+        :return: the result, and whether this call ran the function
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            logger.debug('Waiting for the call in flight for %r', key)
+            return future.result(timeout=self.timeout), False
+
+        try:
+            value = fn()
+        except BaseException as ex:
+            future.set_exception(ex)
+            raise
+        else:
+            future.set_result(value)
+            return value, True
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def do_async(self, key, fn):
+        """
+        The asyncio version of `do`, coalescing the calls of the running event loop
+        :param key: what identifies identical calls
+        :param fn: a coroutine function without arguments
+        :return: the result, and whether this call ran the function
+        """
+        loop = asyncio.get_running_loop()
+        calls = self._async_calls.setdefault(loop, dict())
+        future = calls.get(key)
+        if future is not None:
+            logger.debug('Waiting for the call in flight for %r', key)
+            # Cancelling a waiting caller must not cancel the call it waits for
+            return (await asyncio.shield(future)), False
+
+        future = calls[key] = loop.create_future()
+        try:
+            value = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as ex:
+            future.set_exception(ex)
+            # Nobody may be waiting, do not warn about an exception never retrieved
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            return value, True
+        finally:
+            del calls[key]
@@ -3,3 +3,5 @@ from .mixins import *
 from .model_bases import *
 from .helpers import *
 from .query import *
+from .statement_cache import *
+from .loader_plan import *
@@ -109,13 +109,19 @@ def parse_field_names(crud_metadata, field_names, exclude=None, include=None):
     else:
         field_dotted_names = {}
 
-    pop_excluded = [(f, field_dotted_names.pop(f.exposed_name, None))
-        for f in crud_metadata.fields.values()
-        if f.internal_name in exclude]
+    fields_by_internal_name = crud_metadata.fields_by_internal_name
+    if fields_by_internal_name is not None:
+        pop_excluded = [(f, field_dotted_names.pop(f.exposed_name, None))
+            for f in (fields_by_internal_name.get(name) for name in exclude)
+            if f is not None]
+    else:
+        pop_excluded = [(f, field_dotted_names.pop(f.exposed_name, None))
+            for f in crud_metadata.fields.values()
+            if f.internal_name in exclude]
 
     field_name_pairs = [
         (f, field_dotted_names.pop(f.exposed_name, None))
-        for f in crud_metadata.fields.values()
-        if f.exposed and f.readable and (f.implicit or f.exposed_name in field_dotted_names or f.internal_name in include) and f.internal_name not in exclude
+        for f in crud_metadata.fields_with('readable')
+        if (f.implicit or f.exposed_name in field_dotted_names or f.internal_name in include) and f.internal_name not in exclude
     ]
     return field_dotted_names, field_name_pairs
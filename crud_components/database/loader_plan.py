@@ -0,0 +1,170 @@
+__all__ = ('LoaderPlan', )
+
+import logging
+
+import sqlalchemy as sa
+from sqlalchemy import orm
+from sqlalchemy.ext.orderinglist import OrderingList
+
+from .helpers import parse_field_names
+from .mixins import SummaryMixin
+from .mixins.id_mixin import expose_uid
+
+logger = logging.getLogger(__name__)
+
+
+class LoaderPlan:
+    """
+    Eager loading of the references a read visitor is going to visit, derived from the requested field names.
+    With `project_columns`, only the columns the read fields need are loaded
+    """
+
+    def __init__(self, model_cls, field_names=None, summary=False, exclude=None, include=None, single='joined',
+                 project_columns=False):
+        assert single in ('joined', 'selectin')
+        self.model_cls = model_cls
+        self.single = single
+        self.project_columns = project_columns
+        #: Column keys to load for the root model (empty path) and at the end of each path, None to load them all
+        self.columns = {}
+        # Paths read through a dotted `exposed_as`, we do not know which columns are read there
+        self._exposed_paths = set()
+        paths = self._iter_paths(model_cls, field_names, summary, exclude, include, tuple())
+        self.paths = tuple(dict.fromkeys(paths))
+        for path in self._exposed_paths:
+            self.columns[path] = None
+
+    def _iter_paths(self, model_cls, field_names, summary, exclude, include, path):
+        crud_metadata = model_cls.crud_metadata
+        if summary and issubclass(model_cls, SummaryMixin):
+            field_name_pairs = [(f, None) for f in crud_metadata.summary_fields]
+        else:
+            _, field_name_pairs = parse_field_names(
+                crud_metadata, None if summary else field_names, exclude=exclude, include=include
+            )
+        if self.project_columns:
+            self.columns[path] = self._needed_columns(model_cls, field_name_pairs, summary)
+
+        mapper = sa.inspect(model_cls)
+        for field, sub_field_names in field_name_pairs:
+            if isinstance(field.exposed_as, str) and '.' in field.exposed_as:
+                # e.g. the foreign key exposed as "organization.uid"
+                name = field.exposed_as.split('.', 1)[0]
+                prop = mapper.attrs.get(name)
+                if isinstance(prop, orm.RelationshipProperty):
+                    strategy = 'selectin' if prop.uselist else self.single
+                    sub_path = path + ((model_cls, name, strategy), )
+                    self._exposed_paths.add(sub_path)
+                    yield sub_path
+            if field.type != 'reference' or field.attr_type != 'relationship' or field.exposed_as is not None:
+                continue
+            reference_cls = field.reference_to
+            if reference_cls is model_cls or any(reference_cls is cls for cls, _, _ in path):
+                # Recursive structures are loaded lazily past the first level
+                continue
+            strategy = 'selectin' if field.reference_kind == 'multiple' else self.single
+            sub_path = path + ((model_cls, field.internal_name, strategy), )
+            yield sub_path
+
+            # Same as ModelReadVisitor.visit_reference
+            sub_summary = bool(sub_field_names) and '_summary' in sub_field_names
+            if sub_summary and len(sub_field_names) == 1:
+                sub_field_names = None
+            yield from self._iter_paths(reference_cls, sub_field_names, sub_summary, None, None, sub_path)
+            if self.columns.get(sub_path) is not None:
+                # e.g. an ordering_list reads the position of each child it is loaded with
+                self.columns[sub_path] |= self._collection_columns(mapper.attrs[field.internal_name])
+
+    @staticmethod
+    def _needed_columns(model_cls, field_name_pairs, summary):
+        """
+        The keys of the column properties the fields are read from, None if they cannot be determined
+        """
+        mapper = sa.inspect(model_cls)
+        if mapper.polymorphic_on is not None:
+            return None
+        if summary and issubclass(model_cls, SummaryMixin):
+            # summary_text and summary_subtext can read anything
+            return None
+
+        def attribute_columns(key):
+            prop = mapper.attrs.get(key)
+            if isinstance(prop, orm.ColumnProperty):
+                return {key}
+            elif isinstance(prop, orm.RelationshipProperty):
+                # The foreign keys are needed to load the reference
+                return {mapper.get_property_by_column(c).key for c in prop.local_columns}
+            elif isinstance(prop, orm.CompositeProperty):
+                return {mapper.get_property_by_column(c).key for c in prop.columns}
+            return None
+
+        keys = {mapper.get_property_by_column(c).key for c in mapper.primary_key}
+        for field, _ in field_name_pairs:
+            if field.exposed_as is None or field.exposed_as is expose_uid:
+                # The uid is read from the field itself
+                key = field.internal_name
+            elif isinstance(field.exposed_as, str):
+                # A dotted path, the first part is an attribute of the model
+                key = field.exposed_as.split('.', 1)[0]
+            else:
+                # Any other function may read any column
+                return None
+            columns = attribute_columns(key)
+            if columns is None:
+                # Hybrid properties, extension properties, ...
+                return None
+            keys.update(columns)
+        return frozenset(keys)
+
+    @staticmethod
+    def _collection_columns(prop):
+        """
+        The keys of the columns the collection of a relationship reads when it is loaded
+        """
+        if prop.collection_class is None:
+            return frozenset()
+        collection = prop.collection_class()
+        if isinstance(collection, OrderingList):
+            return frozenset((collection.ordering_attr, ))
+        return frozenset()
+
+    def options(self, skip=()):
+        """
+        The loader options to apply to a query of the model
+        :param skip: names of relationships of the model that are already loaded (e.g. with contains_eager)
+        """
+        root_columns = self.columns.get(tuple())
+        if root_columns is not None:
+            yield orm.load_only(*root_columns)
+
+        for path in self.paths:
+            _, first_name, _ = path[0]
+            if first_name in skip:
+                continue
+            option = orm
+            for model_cls, name, strategy in path:
+                option = getattr(option, strategy + 'load')(getattr(model_cls, name))
+            columns = self.columns.get(path)
+            if columns is not None:
+                option = option.load_only(*columns)
+            yield option
+
+    @property
+    def key(self):
+        """
+        A hashable description of the plan (the options only depend on it)
+        """
+        return self.paths, tuple(sorted(
+            (tuple(name for _, name, _ in path), tuple(sorted(columns)))
+            for path, columns in self.columns.items()
+            if columns is not None
+        ))
+
+    def __bool__(self):
+        return bool(self.paths) or any(columns is not None for columns in self.columns.values())
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join(
+            '.'.join('{}:{}'.format(name, strategy) for _, name, strategy in path)
+            for path in self.paths
+        ))
@@ -1,9 +1,10 @@
 import re
 import logging
+from types import MappingProxyType
 import sqlalchemy as sa
 import sqlalchemy_utils as sau
 import geoalchemy2 as ga
-from collections import OrderedDict, defaultdict
+from collections import OrderedDict, defaultdict, namedtuple
 from sqlalchemy import orm
 from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm.base import ONETOMANY, MANYTOONE, MANYTOMANY
@@ -11,9 +12,13 @@ from sqlalchemy_utils import IntRangeType
 from sqlalchemy.ext.hybrid import HYBRID_PROPERTY
 from ..helpers import *
 from ...model_extensions import *
+from ...utils.lru_cache import LruCache
 
 logger = logging.getLogger(__name__)
 
+#: What ModelWriteVisitor.whitelist needs to know about a model, see CrudMetadata.write_plan
+WritePlan = namedtuple('WritePlan', ('fields', 'names', 'generated', 'uneditable', 'field_name_pairs'))
+
 
 class CrudMetadata:
     
@@ -45,6 +50,23 @@ class CrudMetadata:
     }
     MISSING = object()
 
+    # the capabilities indexed by `build_indexes`, see `fields_with`
+    FIELD_CAPABILITIES = {
+        'orderable': lambda f: bool(f.orderable),
+        'searchable': lambda f: bool(f.searchable),
+        'summary': lambda f: bool(f.extras.get('summary')),
+        'quick_search': lambda f: bool(f.quick_search),
+        'reference': lambda f: f.type == 'reference',
+        'executions': lambda f: any((f.extras.get('executions') or {}).values()),
+        'readable': lambda f: bool(f.exposed and f.readable),
+        'exposed': lambda f: bool(f.exposed),
+        'editable': lambda f: bool(f.exposed and f.editable),
+        'generated': lambda f: bool(f.generated),
+        'uneditable': lambda f: not f.editable,
+        'uneditable_column': lambda f: not f.editable and f.attr_type == 'column',
+        'unique_column': lambda f: bool(f.unique) and f.attr_type == 'column',
+    }
+
     def __init__(self, cls, metadata_builder_factory):
         self.mapper = sa.inspect(cls)
         self.fields = OrderedDict()
@@ -60,6 +82,10 @@ class CrudMetadata:
         self.creatable = True
         self.deletable = True
         self.pagination = True
+        # How searches count their total (see CountStrategy), None to use the one of the helper
+        self.count_strategy = None
+        # The exposed names of the fields identifying the rows of an upsert, None to use the unique field
+        self.upsert_key = None
 
         # For the searchable mixin
         self.quick_search_fields = dict()
@@ -70,11 +96,64 @@ class CrudMetadata:
 
         # fields to be ignored
         self._ignore_fields = set()
+        # indexes of the fields, built with the fields (see build_indexes)
+        self.fields_by_exposed_name = None
+        self.fields_by_internal_name = None
+        self.fields_by_type = None
+        self.fields_by_capability = None
+
+        # whitelist plans by (creating, only_field_names)
+        self._write_plans = LruCache(256)
 
     def build(self):
         self.configure_fields()
+        self.build_indexes()
+
+    def build_indexes(self):
+        """
+        Builds the immutable indexes of the fields, they must be rebuilt if the fields change
+        """
+        by_exposed_name, by_internal_name = {}, {}
+        by_type, by_capability = defaultdict(list), {k: [] for k in self.FIELD_CAPABILITIES}
+        for f in self.fields.values():
+            # The first field wins, like the linear scans used to do
+            by_exposed_name.setdefault(f.exposed_name, f)
+            by_internal_name.setdefault(f.internal_name, f)
+            by_type[f.type].append(f)
+            for capability, predicate in self.FIELD_CAPABILITIES.items():
+                if predicate(f):
+                    by_capability[capability].append(f)
+        self.fields_by_exposed_name = MappingProxyType(by_exposed_name)
+        self.fields_by_internal_name = MappingProxyType(by_internal_name)
+        self.fields_by_type = MappingProxyType({k: tuple(v) for k, v in by_type.items()})
+        self.fields_by_capability = MappingProxyType({k: tuple(v) for k, v in by_capability.items()})
+        self._write_plans.clear()
+
+    def fields_with(self, capability):
+        """
+        :param capability: one of FIELD_CAPABILITIES
+        :return: the fields having the capability, in order
+        """
+        if self.fields_by_capability is None:
+            # Not built yet
+            predicate = self.FIELD_CAPABILITIES[capability]
+            return tuple(f for f in self.fields.values() if predicate(f))
+        return self.fields_by_capability[capability]
+
+    def fields_of_type(self, field_type):
+        """
+        :return: the fields of a type (e.g. 'reference'), in order
+        """
+        if self.fields_by_type is None:
+            return tuple(f for f in self.fields.values() if f.type == field_type)
+        return self.fields_by_type.get(field_type, ())
 
     def find_field_by_exposed_name(self, name):
+        if self.fields_by_exposed_name is not None:
+            try:
+                return self.fields_by_exposed_name[name]
+            except KeyError:
+                raise AttributeError("Field {!r} not found".format(name)) from None
         for f in self.fields.values():
             if f.exposed_name == name:
                 return f
@@ -82,15 +161,72 @@ class CrudMetadata:
             raise AttributeError("Field {!r} not found".format(name))
 
     def find_field_by_internal_name(self, name):
+        if self.fields_by_internal_name is not None:
+            try:
+                return self.fields_by_internal_name[name]
+            except KeyError:
+                raise AttributeError("Field {!r} not found".format(name)) from None
         for f in self.fields.values():
             if f.internal_name == name:
                 return f
         else:
             raise AttributeError("Field {!r} not found".format(name))
 
+    def write_plan(self, creating, only_field_names=None):
+        """
+        The fields that can be written, compiled once per (creating, only_field_names)
+        :param only_field_names: the (dotted) names of the only fields that can be written
+        :return: a WritePlan
+        """
+        key = (bool(creating), frozenset(only_field_names) if only_field_names else None)
+        plan = self._write_plans.get(key)
+        if plan is None:
+            plan = self._build_write_plan(creating, only_field_names)
+            self._write_plans.set(key, plan)
+        return plan
+
+    def _build_write_plan(self, creating, only_field_names=None):
+        whitelist = OrderedDict(
+            (f.exposed_name, f)
+            for f in self.fields_with('exposed' if creating else 'editable')
+        )
+
+        if only_field_names:
+            field_dotted_names = defaultdict(set)
+            for name in only_field_names:
+                first, *last = name.split('.', 1)
+                if not last:
+                    field_dotted_names[first] = set()
+                elif field_dotted_names[first] is not None:
+                    field_dotted_names[first].add(last[0])
+            field_name_pairs = tuple(
+                (f.exposed_name, f, frozenset(field_dotted_names.pop(f.exposed_name)))
+                for f in self.fields_with('exposed')
+                if f.exposed_name in field_dotted_names
+            )
+            names = {name for name, _, _ in field_name_pairs}
+            for k in set(whitelist.keys()).difference(names):
+                del whitelist[k]
+        else:
+            field_dotted_names = None
+            field_name_pairs = tuple(
+                (f.exposed_name, f, None)
+                for f in whitelist.values()
+            )
+
+        assert not field_dotted_names, 'I think this should always be empty here, it is not user input'
+
+        return WritePlan(
+            fields=whitelist,
+            names=frozenset(whitelist.keys()),
+            generated=frozenset(f.exposed_name for f in self.fields_with('generated')),
+            uneditable=frozenset(f.exposed_name for f in self.fields_with('uneditable')),
+            field_name_pairs=field_name_pairs,
+        )
+
     def as_dict(self, field_names):
         assert self.public, 'Calling as_dict on an internal model is pointless'
-        fields = (f for f in self.fields.values() if self.include_field(f, field_names))
+        fields = (f for f in self.fields_with('exposed') if self.include_field(f, field_names))
         fields = self.reorder_fields(fields, field_names)
         return dict(
             fields=[self.translate_keys(f, self.overrides_for_field(f, field_names)) for f in fields],
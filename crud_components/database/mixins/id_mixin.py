@@ -1,12 +1,23 @@
 import sqlalchemy as sa
 from sqlalchemy.ext.declarative import declared_attr
-from crud_components.utils.validators.uid import uid_str, parse_uid
+from crud_components.utils.validators.uid import Uid, get_uid_codec, parse_uid
 
 
 class IdMixinWithSequence:
     pass
 
 
+def expose_uid(s, f):
+    """
+    Exposes the serial id of a field (the id, or a foreign key to a UidMixin) as a uid
+    """
+    return get_uid_codec().encode(Uid(prefix=f.extras['uid_prefix'], serial_id=getattr(s, f.internal_name), version=None))
+
+
+def unexpose_uid(s, f, v):
+    return parse_uid(v, prefix=f.extras['uid_prefix']).serial_id if v else None
+
+
 def id_with_sequence(sequence):
     inherits = IdMixinWithSequence if sequence else object
 
@@ -36,8 +47,8 @@ def id_with_sequence(sequence):
             if issubclass(cls, UidMixin):  # Ugly, but with declared_attr.cascading we cannot override "id" in subclasses
                 # This works but it interferes with references: it will change exposed_as to e.g. organization.uid
                 # info['exposed_as'] = 'uid'
-                info['exposed_as'] = lambda s, f: uid_str(prefix=f.extras['uid_prefix'], serial_id=getattr(s, f.internal_name), version=None)
-                info['unexposed_as'] = lambda s, f, v: parse_uid(v, prefix=f.extras['uid_prefix']).serial_id if v else None
+                info['exposed_as'] = expose_uid
+                info['unexposed_as'] = unexpose_uid
                 info['exposed_name'] = 'uid'
                 info['type'] = 'uid'
                 info['uid_prefix'] = getattr(cls, 'UID_PREFIX', None)
@@ -62,11 +73,31 @@ def id_with_sequence(sequence):
             return col
 
         @classmethod
-        def find(cls, identifier):
+        def find(cls, identifier, options=()):
             if identifier is None:
                 return None
             pkey_value = int(identifier)
-            return cls.query.get(pkey_value)
+            return cls.query.options(*options).get(pkey_value)
+
+        @classmethod
+        def reserve_ids(cls, session, count):
+            """
+            Reserves ids from the sequence with a single query, so that the inserts can be batched
+            :param session: the session whose connection is used
+            :param count: the number of ids to reserve
+            :return: the list of ids, or None if they cannot be reserved in advance
+            """
+            if sequence is None or count < 1:
+                return None
+            connection = session.connection()
+            if connection.dialect.name != 'postgresql':
+                return None
+            query = sa.select([sequence.next_value()]).select_from(sa.func.generate_series(1, count))
+            return [row[0] for row in connection.execute(query)]
+
+        @classmethod
+        def pkey_values(cls, identifiers):
+            return [int(identifier) if identifier is not None else None for identifier in identifiers]
     return IdWithSequence
 
 
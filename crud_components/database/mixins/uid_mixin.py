@@ -1,5 +1,5 @@
 from ...exceptions import ModelValidationError
-from crud_components.utils.validators.uid import uid_str, parse_uid, Uid
+from crud_components.utils.validators.uid import get_uid_codec, parse_uid, Uid
 
 
 class UidMixin:
@@ -9,7 +9,7 @@ class UidMixin:
     @property
     def uid(self):
         version = 0
-        return uid_str(prefix=self.UID_PREFIX, serial_id=self.id, version=version)
+        return get_uid_codec().encode(Uid(prefix=self.UID_PREFIX, serial_id=self.id, version=version))
 
     @uid.setter
     def uid(self, value):
@@ -21,7 +21,7 @@ class UidMixin:
             raise ModelValidationError("Unexpected versioned UID")
 
     @classmethod
-    def find(cls, identifier):
+    def find(cls, identifier, options=()):
         if isinstance(identifier, Uid):
             uid = identifier
         else:
@@ -31,4 +31,15 @@ class UidMixin:
         pkey_value = uid.serial_id if uid is not None else None
         if pkey_value is None:
             return None
-        return cls.query.get(pkey_value)
+        return cls.query.options(*options).get(pkey_value)
+
+    @classmethod
+    def pkey_values(cls, identifiers):
+        codec = get_uid_codec()
+        pkey_values = []
+        for identifier in identifiers:
+            uid = identifier if isinstance(identifier, Uid) else codec.decode(identifier)
+            if uid is not None and uid.prefix != cls.UID_PREFIX:
+                raise ModelValidationError("Invalid UID {!r}; expected prefix {!r}".format(identifier, cls.UID_PREFIX))
+            pkey_values.append(uid.serial_id if uid is not None else None)
+        return pkey_values
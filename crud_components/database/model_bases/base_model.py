@@ -1,7 +1,10 @@
+from collections import OrderedDict
+from itertools import chain
 from sqlalchemy import orm, inspect
+from sqlalchemy.orm.base import MANYTOONE
 import sqlalchemy as sa
 from .abstract_base_model import AbstractBaseModel
-from ...model_extensions import SkipExtension
+from ...model_extensions import SkipExtension, Stage
 from ...exceptions import  ModelValidationError
 
 
@@ -16,9 +19,69 @@ class BaseModel(AbstractBaseModel):
         return cls()
 
     @classmethod
-    def find(cls, identifier):
+    def find(cls, identifier, options=()):
         # Overridden in IdMixin, UidMixin and VersionedMixin
-        return cls.query.get(identifier)
+        return cls.query.options(*options).get(identifier)
+
+    @classmethod
+    def find_many(cls, identifiers, options=()):
+        """
+        Finds the instances of many identifiers with a single query
+        :param identifiers: an iterable of identifiers, as accepted by `find`
+        :param options: loader options
+        :return: the list of instances (None when not found), in the order of the identifiers
+        """
+        return cls.find_many_by_pkey(cls.pkey_values(identifiers), options)
+
+    @classmethod
+    def pkey_values(cls, identifiers):
+        """
+        Converts identifiers, as accepted by `find`, to primary key values
+        :param identifiers: an iterable of identifiers
+        :return: the list of primary key values (None for None)
+        """
+        # Overridden in IdMixin and UidMixin
+        return list(identifiers)
+
+    @classmethod
+    def find_many_by_pkey(cls, pkey_values, options=()):
+        mapper = inspect(cls)
+        if len(mapper.primary_key) != 1:
+            return [cls.find(v, options) if v is not None else None for v in pkey_values]
+        pkey = mapper.primary_key[0]
+        found = {}
+        wanted = set(v for v in pkey_values if v is not None)
+        if wanted:
+            for instance in cls.query.options(*options).filter(pkey.in_(wanted)):
+                found[mapper.primary_key_from_instance(instance)[0]] = instance
+        return [found.get(v) for v in pkey_values]
+
+    @classmethod
+    def can_delete_in_bulk(cls):
+        """
+        Whether rows can be deleted with a single DELETE statement, bypassing the unit of work:
+        a single table, without delete executions, delete events or ORM-level cascades
+        """
+        mapper = inspect(cls)
+        if mapper.inherits is not None or len(mapper.self_and_descendants) > 1:
+            return False
+        model_executions = cls.crud_metadata.model_executions if cls.crud_metadata is not None else None
+        if model_executions and model_executions[Stage.PRE_FLUSH_DELETE]:
+            return False
+        if mapper.dispatch.before_delete or mapper.dispatch.after_delete:
+            return False
+        for rel in mapper.relationships:
+            if rel.viewonly:
+                continue
+            # The unit of work would delete the children, or nullify their foreign keys, or delete the secondary rows
+            if rel.cascade.delete or (rel.direction is not MANYTOONE and not rel.passive_deletes):
+                return False
+        return True
+
+    @classmethod
+    def reserve_ids(cls, session, count):
+        # Overridden in IdMixin when the id has a sequence
+        return None
 
     def update_from_dict(self, visitor, iter_whitelist, with_extensions=None):
         """
@@ -44,6 +107,12 @@ class BaseModel(AbstractBaseModel):
         :return:
         """
         dikt = dict()
+        visits = getattr(field_name_pairs, 'visits', None)
+        if visits is not None:
+            # Prebuilt by the visitor (see ModelReadVisitor.read_plan)
+            for visit in visits:
+                visit(visitor, dikt, self)
+            return dikt
         for field, sub_field_names in field_name_pairs:
             visitor.visit_field(dikt, self, field, field_names=sub_field_names)
         return dikt
@@ -162,28 +231,37 @@ class BaseModel(AbstractBaseModel):
         The actual checking happens at the DB level when the transaction is being persisted in the DB.
 
         This check is used to display a nice message for the user.
+        The instances created or modified in the session are checked too, see `assert_uniqueness_many`.
         :return:
         """
-        # TODO handle uniqueness in translatable fields and use fields metadata
-        mapper = inspect(self).mapper
-        for name, col in mapper.columns.items():
-            if not col.unique:
-                continue
-            value = getattr(self, name)
-            if value is None and col.nullable:
-                continue
-            match = self.query.filter(col == value).limit(1).one_or_none()
-            if match is None:
-                # No conlict found
-                continue
+        self.assert_uniqueness_many([self])
 
-            if match.id == self.id:
-                # The only match is the instance itself
-                # (self.id would be None if it's a newly created instance)
-                continue
+    @classmethod
+    def assert_uniqueness_many(cls, instances, with_session=True):
+        """
+        optimistic check for uniqueness of many instances, with one query per model, see `assert_uniqueness`.
+        :param with_session: also check the instances created or modified in their session
+        """
+        # TODO handle uniqueness in translatable fields and use fields metadata
+        instances = list(instances)
+        if not instances:
+            return
+        session = inspect(instances[0]).session
+        if session is None:
+            # Transient instances are checked through the session of the model's query
+            session = type(instances[0]).query.session
+        if with_session:
+            instances.extend(
+                instance
+                for instance in chain(session.new, session.dirty)
+                if isinstance(instance, BaseModel) and _unique_values_changed(instance)
+            )
 
-            # There's a conflict with another instance
-            raise ModelValidationError("Field {} is not unique".format(name))
+        by_mapper = OrderedDict()
+        for instance in instances:
+            by_mapper.setdefault(inspect(instance).mapper, OrderedDict())[id(instance)] = instance
+        for mapper, mapper_instances in by_mapper.items():
+            _assert_unique_values(session, mapper, mapper_instances.values())
 
     def __repr__(self):
         """
@@ -206,3 +284,91 @@ class BaseModel(AbstractBaseModel):
             expired=', expired={!r}'.format(state.expired_attributes) if state.expired_attributes else '',
             state=' '.join(k for k in self.__STATES if getattr(state, k))
         )
+
+
+_unique_keys_cache = {}
+
+
+def _unique_keys(mapper):
+    """
+    The unique keys of a mapper: single unique columns and composite unique constraints
+    :param mapper:
+    :return: a list of tuples of (attribute name, column) pairs
+    """
+    try:
+        return _unique_keys_cache[mapper]
+    except KeyError:
+        pass
+    keys = OrderedDict()
+    for name, col in mapper.columns.items():
+        if getattr(col, 'unique', False):
+            keys.setdefault(frozenset([col]), ((name, col),))
+    for table in mapper.tables:
+        for constraint in table.constraints:
+            if not isinstance(constraint, sa.UniqueConstraint):
+                continue
+            try:
+                key = tuple((mapper.get_property_by_column(col).key, col) for col in constraint.columns)
+            except orm.exc.UnmappedColumnError:
+                continue
+            if key:
+                keys.setdefault(frozenset(constraint.columns), key)
+    _unique_keys_cache[mapper] = rv = list(keys.values())
+    return rv
+
+
+def _unique_values_changed(instance):
+    state = inspect(instance)
+    if state.pending:
+        return True
+    return any(
+        state.attrs[name].history.has_changes()
+        for key in _unique_keys(state.mapper)
+        for name, _ in key
+    )
+
+
+def _assert_unique_values(session, mapper, instances):
+    keys = _unique_keys(mapper)
+    if not keys:
+        return
+    # For every key, the instance owning each value
+    owners = [dict() for _ in keys]
+    for instance in instances:
+        for key, key_owners in zip(keys, owners):
+            value = tuple(getattr(instance, name) for name, _ in key)
+            if any(v is None for v in value) and (len(key) > 1 or key[0][1].nullable):
+                # NULLs never conflict
+                continue
+            if key_owners.setdefault(value, instance) is not instance:
+                raise ModelValidationError("Field {} is not unique".format(', '.join(name for name, _ in key)))
+
+    criteria = []
+    for key, key_owners in zip(keys, owners):
+        if not key_owners:
+            continue
+        cols = [col for _, col in key]
+        if len(cols) == 1:
+            criteria.append(cols[0].in_([value for value, in key_owners.keys()]))
+        elif session.get_bind(mapper).dialect.name == 'postgresql':
+            criteria.append(sa.tuple_(*cols).in_(list(key_owners.keys())))
+        else:
+            criteria.extend(sa.and_(*(col == v for col, v in zip(cols, value))) for value in key_owners.keys())
+    if not criteria:
+        return
+
+    pkey = list(mapper.primary_key)
+    key_cols = [col for key in keys for _, col in key]
+    with session.no_autoflush:
+        matches = session.query(*(pkey + key_cols)).filter(sa.or_(*criteria)).all()
+
+    for row in matches:
+        identity, values = tuple(row[:len(pkey)]), row[len(pkey):]
+        for key, key_owners in zip(keys, owners):
+            value, values = tuple(values[:len(key)]), values[len(key):]
+            owner = key_owners.get(value)
+            if owner is None or inspect(owner).identity == identity:
+                # No conflict, or the only match is the instance itself
+                continue
+            # There's a conflict with another instance
+            raise ModelValidationError("Field {} is not unique".format(', '.join(name for name, _ in key)))
@@ -1,18 +1,20 @@
 __all__ = (
     'UserFilters', 'UserFilterItem', 'UserFilterConnector', 'UserOrder',
-    'AliasesCollection', 'make_search_queries',
+    'AliasesCollection', 'make_search_queries', 'make_ids_query', 'WINDOW_TOTAL_LABEL', 'ParamBinder',
 )
 
 import itertools
 import logging
 from collections import namedtuple
+from datetime import date, datetime, time
+from decimal import Decimal, InvalidOperation
 
 from sqlalchemy_utils import escape_like
 from sqlalchemy import orm
 import sqlalchemy as sa
 
 from .helpers import parse_field_names
-from crud_components.utils.validators import parse_uid, ga_point_from_dict
+from crud_components.utils.validators import get_uid_codec, ga_point_from_dict
 from ..exceptions import MetadataValidationProblem
 
 logger = logging.getLogger(__name__)
@@ -25,21 +27,67 @@ OPERATOR_FILTER_MAP = {
     'gte': lambda f, v: f >= v,
     'lt': lambda f, v: f < v,
     'lte': lambda f, v: f <= v,
-    'contains': lambda f, v: f.ilike('%{}%'.format(escape_like(v))),
-    'contains_cs': lambda f, v: f.like('%{}%'.format(escape_like(v))),
-    'eq_cs': lambda f, v: f.ilike('{}'.format(escape_like(v))),
-    'neq_cs': lambda f, v: ~f.ilike('{}'.format(escape_like(v))),
-    'near': lambda f, v: f.ST_DWithin(ga_point_from_dict(v), v.get('radius', '20000')),
+    'contains': lambda f, v: f.ilike(v),
+    'contains_cs': lambda f, v: f.like(v),
+    'eq_cs': lambda f, v: f.ilike(v),
+    'neq_cs': lambda f, v: ~f.ilike(v),
+    'near': lambda f, v: f.ST_DWithin(*v),
     'in': lambda f, v: sa.or_(*(f.any(vv) for vv in v)),  # field: array; value: array
     'all': lambda f, v: sa.and_(*(f.any(vv) for vv in v)),  # field: array; value: array
     'any': lambda f, v: f.any(v),  # field: array; value: string
     'array_contains': lambda f, v: f.contains(sa.cast(v, sa.ARRAY(sa.Unicode))),  # field: array; value: array
 }
 
+# Turns the (transformed) user value into what the operator compares to
+# A tuple is a fixed number of values (i.e. part of the structure of the condition)
+OPERATOR_VALUE_MAP = {
+    'contains': lambda v: '%{}%'.format(escape_like(v)),
+    'contains_cs': lambda v: '%{}%'.format(escape_like(v)),
+    'eq_cs': lambda v: '{}'.format(escape_like(v)),
+    'neq_cs': lambda v: '{}'.format(escape_like(v)),
+    'near': lambda v: (ga_point_from_dict(v), v.get('radius', '20000')),
+    'in': tuple,
+    'all': tuple,
+}
+
 UserFilterItem = namedtuple('UserFilterItem', 'field,operator,value,case_sensitive')
 UserFilterConnector = namedtuple('UserFilterConnector', 'operand,items')
 UserOrder = namedtuple('UserOrder', 'field,direction,modifier,value')
 
+#: Label of the `count(*) OVER ()` column added to the page query when counting in the same round trip
+WINDOW_TOTAL_LABEL = 'window_total'
+
+
+def _value_shape(value):
+    if value is None:
+        return None
+    elif isinstance(value, tuple):
+        return len(value)
+    return True
+
+
+class ParamBinder:
+    """
+    Replaces the values of a search by bound parameters, named after the order they are bound in,
+    and collects these values.
+    Binding the same filters twice binds the same names, as long as it is done in the same order
+    (see `UserFilters.shape`).
+    """
+
+    def __init__(self, prefix='p'):
+        self.prefix = prefix
+        self.params = {}
+
+    def __call__(self, value):
+        if value is None:
+            # Comparisons to None are rendered as IS NULL, they are part of the structure
+            return None
+        elif isinstance(value, tuple):
+            return tuple(self(v) for v in value)
+        name = '{}{}'.format(self.prefix, len(self.params))
+        self.params[name] = value
+        return sa.bindparam(name)
+
 
 def _transform_value(field, value):
     if field.type == 'integer':
@@ -48,12 +96,35 @@ def _transform_value(field, value):
         prefix = field.extras.get('uid_prefix')
         if prefix is None:
             logger.warning("Using a UID field in a filter without specifying uid_prefix")
-        uid = parse_uid(value, prefix=prefix)
+        uid = get_uid_codec().decode(value, prefix=prefix)
         return uid.serial_id if uid is not None else None
     else:
         return value
 
 
+_KEYSET_VALUE_LOADERS = {
+    'datetime': datetime.fromisoformat,
+    'date': date.fromisoformat,
+    'time': time.fromisoformat,
+    'number': Decimal,
+}
+
+
+def _dump_keyset_value(field, value):
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    elif isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _load_keyset_value(field, value):
+    loader = _KEYSET_VALUE_LOADERS.get(field.type)
+    if loader is None or value is None:
+        return value
+    return loader(value)
+
+
 class UserFilters:
     def __init__(self, model_cls, custom_filter, filter=None, term="", include=None, exclude=None, order=None):
         self.model_cls = model_cls
@@ -121,69 +192,81 @@ class UserFilters:
                 detail="Invalid field name or order value or data type in request",
             ) from ex
 
-    def _item_condition(self, filter_item, aliases):
-        field, op, value, case_sensitive = filter_item
-        col = self.model_cls.column_by_field(field, multiple=True, aliases=aliases)
+    @staticmethod
+    def _operator_name(op, case_sensitive):
+        if case_sensitive and op + '_cs' in OPERATOR_FILTER_MAP:
+            return op + '_cs'
+        assert op in OPERATOR_FILTER_MAP, 'We should not get here'
+        return op
 
-        needed_joins = field.needed_joins
-        for join in needed_joins:
-            aliases.add_pending_join(join)
-
-        if case_sensitive:
-            func_names = (op + '_cs', op)
-        else:
-            func_names = (op,)
-        for fname in func_names:
-            operator_function = OPERATOR_FILTER_MAP.get(fname)
-            if operator_function is not None:
-                break
-        else:
-            assert False, 'We should not get here'
+    def _item_value(self, filter_item):
+        field, op, value, case_sensitive = filter_item
+        value_function = OPERATOR_VALUE_MAP.get(self._operator_name(op, case_sensitive))
         try:
             value = _transform_value(field, value)
+            if value is not None and value_function is not None:
+                value = value_function(value)
         except (AttributeError, KeyError, TypeError, ValueError) as ex:
             logger.debug("Failed to transform input in filter value", exc_info=True)
             raise MetadataValidationProblem(
                 title="Invalid filter values",
                 detail="Invalid filter value for field {}".format(field.exposed_name),
             ) from ex
+        return value
+
+    def _item_condition(self, filter_item, aliases, binder=None):
+        field, op, value, case_sensitive = filter_item
+        col = self.model_cls.column_by_field(field, multiple=True, aliases=aliases)
+
+        needed_joins = field.needed_joins
+        for join in needed_joins:
+            aliases.add_pending_join(join)
+
+        operator_function = OPERATOR_FILTER_MAP[self._operator_name(op, case_sensitive)]
+        value = self._item_value(filter_item)
+        if binder is not None:
+            value = binder(value)
         return operator_function(col, value)
 
-    def _condition(self, item, aliases):
+    def _condition(self, item, aliases, binder=None):
         if isinstance(item, UserFilterItem):
-            return self._item_condition(item, aliases)
+            return self._item_condition(item, aliases, binder)
         else:
             operand, items = item
             operand_func = sa.and_ if operand == 'and' else sa.or_
-            return operand_func(*(self._condition(it, aliases) for it in items))
+            return operand_func(*(self._condition(it, aliases, binder) for it in items))
 
-    def iter_criteria(self, aliases):
+    def _iter_criteria_items(self):
         for cond in self.custom_filter:
-            yield self._condition(cond, aliases), True
+            yield cond, True
 
         # if issubclass(self.model_cls, WeakVersionableMixin):
         #     deleted_field = self.model_cls.crud_metadata.find_field_by_internal_name('deleted')
         #     filter_item = UserFilterItem(field=deleted_field, operator='eq', value=False, case_sensitive=False)
-        #     yield self._condition(filter_item, aliases), True
+        #     yield filter_item, True
 
         if self.term:
             term_conditions = UserFilterConnector('or', tuple(
                 UserFilterItem(field=field, operator=operator, value=self.term, case_sensitive=False)
                 for field, operator in self.model_cls.crud_metadata.quick_search_fields.items()
             ))
-            yield self._condition(UserFilterConnector('and', (
+            yield UserFilterConnector('and', (
                 term_conditions,
                 UserFilterConnector('and', self.tree)
-            )), aliases), True
+            )), True
         else:
-            yield from ((self._condition(c, aliases), True) for c in self.tree)
+            yield from ((c, True) for c in self.tree)
 
         if self.include or self.exclude:
             uid_field = self.model_cls.crud_metadata.find_field_by_exposed_name('uid')
             for uid in self.include:
-                yield self._condition(UserFilterItem(uid_field, 'neq', uid, False), aliases), False
+                yield UserFilterItem(uid_field, 'neq', uid, False), False
             for uid in self.exclude:
-                yield self._condition(UserFilterItem(uid_field, 'neq', uid, False), aliases), True
+                yield UserFilterItem(uid_field, 'neq', uid, False), True
+
+    def iter_criteria(self, aliases, binder=None):
+        for item, apply_to_total in self._iter_criteria_items():
+            yield self._condition(item, aliases, binder), apply_to_total
 
     def get_order(self, aliases):
         if self.orders:
@@ -216,12 +299,110 @@ class UserFilters:
         has_extra_query = bool(self.include)
         return order_by_args, extra_columns, has_extra_query
 
-    def iter_extra_query_criteria(self, aliases):
+    def get_keyset(self):
+        """
+        The (field, direction) pairs that identify the position of a row in the requested order,
+        including the "id" tiebreaker.
+        :return: a tuple of pairs, or None if the order cannot be used to seek (the offset has to be used instead)
+        """
+        if self.include:
+            # The included rows are prepended with a union, they are not part of the order
+            return None
+        for order in self.orders:
+            if order.modifier is not None or order.field.needed_joins or order.field.attr_type != 'column':
+                # The value of the sort key cannot be read back from the instance
+                return None
+            if self._nullable(order.field):
+                # NULL sort keys make the row comparison NULL, the rows having them would never be sought
+                return None
+        keyset = [(order.field, order.direction) for order in self.orders]
+        # TODO name of "id" field can be customized?
+        if all('id' != order.field.internal_name for order in self.orders):
+            keyset.append((self.model_cls.crud_metadata.find_field_by_internal_name('id'), 'asc'))
+        return tuple(keyset)
+
+    def _nullable(self, field):
+        prop = sa.inspect(self.model_cls).attrs.get(field.internal_name)
+        columns = getattr(prop, 'columns', None)
+        if not columns:
+            return True
+        # Expressions (column_property) have no nullable flag, they may be NULL
+        return any(getattr(c, 'nullable', True) for c in columns)
+
+    @staticmethod
+    def dump_keyset_values(keyset, instance):
+        values = [_dump_keyset_value(field, getattr(instance, field.internal_name)) for field, _ in keyset]
+        if any(v is None for v in values):
+            # NULLs cannot be compared, the next page has to use the offset
+            return None
+        return values
+
+    @staticmethod
+    def load_keyset_values(keyset, values):
+        if not values or len(values) != len(keyset):
+            return None
+        try:
+            return tuple(_load_keyset_value(field, v) for (field, _), v in zip(keyset, values))
+        except (TypeError, ValueError, InvalidOperation):
+            logger.debug("Invalid keyset values %r", values, exc_info=True)
+            return None
+
+    def keyset_criterion(self, keyset, values, aliases, binder=None):
+        """
+        The condition selecting the rows that come after the given sort key values, i.e. `(k1, k2, id) > (v1, v2, v3)`
+        """
+        values = tuple(values) if binder is None else binder(tuple(values))
+        columns = [
+            self.model_cls.column_by_field(field, multiple=True, aliases=aliases)
+            for field, _ in keyset
+        ]
+        directions = set(direction for _, direction in keyset)
+        if len(directions) == 1:
+            # Row value comparison, can be answered with a (multi-column) index scan
+            lhs, rhs = sa.tuple_(*columns), sa.tuple_(*values)
+            return lhs > rhs if directions.pop() == 'asc' else lhs < rhs
+
+        # Mixed directions: (k1 > v1) or (k1 = v1 and k2 < v2) or ...
+        clauses = []
+        for i, ((_, direction), col, value) in enumerate(zip(keyset, columns, values)):
+            seek = col > value if direction == 'asc' else col < value
+            clauses.append(sa.and_(*(c == v for c, v in zip(columns[:i], values[:i])), seek))
+        return sa.or_(*clauses)
+
+    def _extra_query_item(self):
         uid_field = self.model_cls.crud_metadata.find_field_by_exposed_name('uid')
-        yield self._condition(UserFilterConnector('or', (
+        return UserFilterConnector('or', tuple(
             UserFilterItem(uid_field, 'eq', uid, False)
             for uid in self.include
-        )), aliases)
+        ))
+
+    def iter_extra_query_criteria(self, aliases, binder=None):
+        yield self._condition(self._extra_query_item(), aliases, binder)
+
+    def shape(self, binder, after_key=None):
+        """
+        The structure of the filters and orders, without the values the filters compare to
+        :param binder: a ParamBinder collecting the values, named as they are when building the queries
+        :param after_key: the sort key values to seek after (keyset pagination), if any
+        :return: a hashable structure
+        """
+        def walk(item):
+            if isinstance(item, UserFilterItem):
+                value = binder(self._item_value(item))
+                return item.field.internal_name, item.operator, item.case_sensitive, _value_shape(value)
+            operand, items = item
+            return operand, tuple(walk(it) for it in items)
+
+        # Same order as in make_search_queries: criteria, keyset then extra query
+        criteria = tuple((walk(item), apply_to_total) for item, apply_to_total in self._iter_criteria_items())
+        if after_key is not None:
+            binder(tuple(after_key))
+        extra = walk(self._extra_query_item()) if self.include else None
+        orders = tuple(
+            (order.field.internal_name, order.direction, order.modifier, repr(order.value))
+            for order in self.orders
+        )
+        return self.model_cls.__name__, criteria, extra, orders
 
     def __hashable(self):
         return (
@@ -241,6 +422,7 @@ class AliasesCollection:
         self.model_cls = model_cls
         self.alias_list = []
         self.pending_joins = []
+        self.joined_relations = set()
 
     def _generate_alias(self, rel_cls):
         name = '{}_{}'.format(self.model_cls.__name__, rel_cls.__name__)
@@ -268,6 +450,7 @@ class AliasesCollection:
 
     def append_and_join(self, query, relation, alias):
         alias = self.append(alias, relation)
+        self.joined_relations.add(getattr(relation, 'key', relation))
         return self._add_alias_join(query, relation, alias)
 
     def add_pending_join(self, join):
@@ -284,7 +467,16 @@ class AliasesCollection:
         return iter(self.alias_list)
 
 
-def make_search_queries(model_cls, filters, count, offset, field_names=None, with_extra_columns=False):
+def make_search_queries(model_cls, filters, count, offset, field_names=None, with_extra_columns=False,
+                        keyset=None, after_key=None, with_window_total=False, binder=None, loader_plan=None):
+    """
+    Builds the page query and the count query of a search
+    :param count: None, with an offset of None, to select all the results
+    :param binder: a ParamBinder, to bind the values the filters compare to instead of inlining them
+    :param loader_plan: a LoaderPlan of the references to load eagerly
+    :param with_window_total: every row carries the total (WINDOW_TOTAL_LABEL), not when seeking or including rows
+    """
+    assert not with_window_total or (after_key is None and not filters.include)
     query = model_cls.query
 
     aliases = AliasesCollection(model_cls)
@@ -296,7 +488,7 @@ def make_search_queries(model_cls, filters, count, offset, field_names=None, wit
 
     extra_query = query
     total_query = query
-    for criterion, apply_to_total in filters.iter_criteria(aliases):
+    for criterion, apply_to_total in filters.iter_criteria(aliases, binder):
         query = aliases.apply_pending_joins(query)
         query = query.filter(criterion)
         if apply_to_total:
@@ -305,24 +497,59 @@ def make_search_queries(model_cls, filters, count, offset, field_names=None, wit
     order_by_args, extra_columns, has_extra_query = filters.get_order(aliases)
     query = aliases.apply_pending_joins(query)
 
+    if after_key is not None:
+        # Seek to the row following the last one of the previous page instead of skipping `offset` rows
+        query = query.filter(filters.keyset_criterion(keyset, after_key, aliases, binder))
+
     if has_extra_query:
-        for criterion in filters.iter_extra_query_criteria(aliases):
+        for criterion in filters.iter_extra_query_criteria(aliases, binder):
             extra_query = aliases.apply_pending_joins(extra_query)
             extra_query = extra_query.filter(criterion)
 
+    if loader_plan:
+        # The relationships joined for the filters and orders are already loaded with contains_eager
+        loader_options = tuple(loader_plan.options(skip=aliases.joined_relations))
+        query = query.options(*loader_options)
+        extra_query = extra_query.options(*loader_options)
+
     if extra_columns and with_extra_columns:
         query = query.add_columns(*extra_columns)
         extra_query = extra_query.add_columns(*extra_columns)
 
+    if with_window_total:
+        # Window functions are computed before the LIMIT/OFFSET
+        query = query.add_columns(sa.func.count().over().label(WINDOW_TOTAL_LABEL))
+
     # Setting it initially will fail when using joinedload
     # See https://stackoverflow.com/a/39553869/1043456
     total_query = total_query.with_entities(sa.func.count(model_cls.id))
 
     query = query.order_by(*order_by_args)
-    query = query.limit(count)
-    query = query.offset(offset)
+    if count is not None:
+        query = query.limit(count)
+    if after_key is None and offset is not None:
+        query = query.offset(offset)
 
     if has_extra_query:
         query = extra_query.union_all(query)
 
     return query, total_query, extra_columns and with_extra_columns
+
+
+def make_ids_query(model_cls, filters):
+    """
+    Builds the statement selecting the ids of the rows matching the filters (e.g. to delete them).
+    The included rows are not part of the selection, they only make sense when displaying a search.
+    """
+    query = model_cls.query
+
+    aliases = AliasesCollection(model_cls)
+    for criterion, apply_to_total in filters.iter_criteria(aliases):
+        if not apply_to_total:
+            continue
+        query = aliases.apply_pending_joins(query)
+        query = query.filter(criterion)
+    query = aliases.apply_pending_joins(query)
+
+    # The joins stay in the statement, but not the columns loaded with contains_eager
+    return query.enable_eagerloads(False).statement.with_only_columns([model_cls.id])
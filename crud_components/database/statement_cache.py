@@ -0,0 +1,101 @@
+__all__ = ('SearchStatementCache', )
+
+import logging
+
+import sqlalchemy as sa
+from sqlalchemy.ext import baked
+
+from .query import ParamBinder, make_search_queries
+from ..utils import LruCache
+
+logger = logging.getLogger(__name__)
+
+
+class BoundBakedQuery:
+    """
+    A cached search query with the parameters of one request.
+    Quacks like the Query objects returned by `make_search_queries` as far as the search helper is concerned.
+    """
+
+    def __init__(self, baked_query, session, params):
+        self.baked_query = baked_query
+        self.session = session
+        self.params = params
+
+    def _result(self):
+        return self.baked_query(self.session).params(**self.params)
+
+    def all(self):
+        return self._result().all()
+
+    def scalar(self):
+        return self._result().scalar()
+
+    @property
+    def statement(self):
+        return self.baked_query.to_query(self.session).statement.params(**self.params)
+
+
+class SearchStatementCache:
+    """
+    Caches the search queries, and their compiled SQL, by the shape of the filters (see `UserFilters.shape`).
+    The values of the filters, the limit and the offset are bound as parameters.
+    Uses the SQLAlchemy baked queries, evicting the least recently used shapes.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._bakery = baked.bakery(size=maxsize)
+        # Remembers what we need to know about the queries without building them
+        self._shapes = LruCache(maxsize=maxsize)
+
+    @property
+    def hits(self):
+        return self._shapes.hits
+
+    @property
+    def misses(self):
+        return self._shapes.misses
+
+    def stats(self):
+        return self._shapes.stats()
+
+    def clear(self):
+        self._shapes.clear()
+        self._bakery.cache.clear()
+
+    def make_search_queries(self, session, model_cls, filters, count, offset, field_names=None,
+                            with_extra_columns=False, keyset=None, after_key=None, with_window_total=False,
+                            loader_plan=None):
+        """
+        Same as `make_search_queries`, but the queries are only built the first time a shape is seen
+        """
+        binder = ParamBinder()
+        key = (
+            model_cls, filters.shape(binder, after_key=after_key), tuple(field_names or ()),
+            with_extra_columns, keyset is not None, after_key is not None, with_window_total,
+            loader_plan.key if loader_plan is not None else None,
+        )
+        params = dict(binder.params, limit=count, offset=offset)
+
+        built = []
+
+        def build():
+            if not built:
+                logger.debug('Building search queries for %r', key)
+                built.extend(make_search_queries(
+                    model_cls, filters, sa.bindparam('limit'), sa.bindparam('offset'), field_names,
+                    with_extra_columns=with_extra_columns, keyset=keyset, after_key=after_key,
+                    with_window_total=with_window_total, binder=ParamBinder(), loader_plan=loader_plan,
+                ))
+            return built
+
+        has_extra = self._shapes.get(key)
+        if has_extra is None:
+            has_extra = build()[2]
+            self._shapes.set(key, has_extra)
+
+        # The key of a baked query is the code of the function and the arguments
+        query = self._bakery(lambda s: build()[0].with_session(s), key)
+        total_query = self._bakery(lambda s: build()[1].with_session(s), key)
+        return BoundBakedQuery(query, session, params), BoundBakedQuery(total_query, session, params), has_extra
@@ -9,6 +9,14 @@ class Extension(metaclass=ExtensionMeta):
     __implicit__ = False
     __properties__ = {}
     __executions__ = {}
+    #: Whether `update` reads the properties before setting them, to only count the actual changes.
+    #: Off by default: properties may be write-only, or read from the database.
+    __compare_updates__ = False
+
+    #: Optional `expose_many(self, instances, field)`, exposing a field of several instances at once.
+    #: It is called on the extension instance of the first of them and returns their values in the same order.
+    #: When None, the read path calls `expose` for each instance.
+    expose_many = None
 
     def __init__(self, session, instance):
         self.session = session
@@ -30,20 +38,43 @@ class Extension(metaclass=ExtensionMeta):
 
     def update(self, instance, field, value):
         assert instance is self.instance
-        # before = getattr(self, field.internal_name)
+        if not self.__compare_updates__:
+            setattr(self, field.internal_name, value)
+            return value, 1
+        before = getattr(self, field.internal_name)
         setattr(self, field.internal_name, value)
-        # after = getattr(self, field.internal_name)
-        # return value, 0 if before == after else 1
-        return value, 1  # TODO change detection for property extensions?
+        # Compare with the new value rather than reading it back, the getter may return the object it mutated
+        return value, 0 if before == value else 1
+
+    @classmethod
+    def has_batched_executions(cls, stage):
+        return any(v.batched for v in cls.sorted_executions(stage, ExtensionPropertyExecution.MODEL_EXECUTION))
 
     def model_execute(self, parent_visitor, stage, instance, value=None):
         assert instance is self.instance
         for execution_function in self.sorted_executions(stage, ExtensionPropertyExecution.MODEL_EXECUTION):
+            if execution_function.batched:
+                # See model_execute_many
+                continue
             if execution_function.with_parent_visitor:
                 execution_function(self, value=value, parent_visitor=parent_visitor)
             else:
                 execution_function(self, value=value)
 
+    def model_execute_many(self, parent_visitor, stage, pairs):
+        """
+        Runs the batched model-level executions of a stage, once for all the instances visited
+        :param pairs: the (instance, value) pairs, the instance of this extension being the first one
+        """
+        assert pairs and pairs[0][0] is self.instance
+        for execution_function in self.sorted_executions(stage, ExtensionPropertyExecution.MODEL_EXECUTION):
+            if not execution_function.batched:
+                continue
+            if execution_function.with_parent_visitor:
+                execution_function(self, pairs=pairs, parent_visitor=parent_visitor)
+            else:
+                execution_function(self, pairs=pairs)
+
     def execute(self, parent_visitor, stage, instance, field, value, overriden=None):
         assert instance is self.instance
         for execution_function in self.sorted_executions(stage, field.internal_name):
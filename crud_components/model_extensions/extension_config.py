@@ -8,3 +8,8 @@ class ExtensionConfiguration:
 
     def instantiate(self, session, instance):
         return self.extension_cls(session, instance, *self.args, **self.kwargs)
+
+    def __repr__(self):
+        return 'ExtensionConfiguration({}, args={!r}, kwargs={!r})'.format(
+            self.extension_cls.__qualname__, self.args, self.kwargs
+        )
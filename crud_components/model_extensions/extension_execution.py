@@ -13,6 +13,10 @@ class ExtensionPropertyExecution:
         self.priority = info.get('priority', 0)
         self.with_parent_visitor = info.get('with_parent_visitor', False)
         self.overrides = info.get('overrides', False)
+        # Batched model-level executions get all the (instance, value) pairs of a stage at once
+        self.batched = info.get('batched', False)
+        if self.batched and self.name != self.MODEL_EXECUTION:
+            raise TypeError('Only model-level executions can be batched')
 
     def assign(self, extension_cls):
         if self.extension_cls is not None:
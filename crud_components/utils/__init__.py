@@ -1,3 +1,4 @@
 from .validators import *
 from .enum_array import ArrayOfEnum
 from .jsonifiable import Jsonifiable
+from .lru_cache import LruCache
@@ -0,0 +1,65 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LruCache:
+    """
+    A bounded, thread-safe mapping that evicts the least recently used entries.
+    Entries optionally expire after `ttl` seconds.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, timer=time.monotonic):
+        assert maxsize > 0
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires <= self.timer():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = self.timer() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            value, _ = self._data.pop(key, (default, None))
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return dict(size=len(self), maxsize=self.maxsize, hits=self.hits, misses=self.misses)
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return '{}(size={}, maxsize={}, ttl={!r})'.format(type(self).__name__, len(self), self.maxsize, self.ttl)
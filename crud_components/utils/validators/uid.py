@@ -1,12 +1,14 @@
-__all__ = ('Uid', 'UidValidator', 'UidValueError', 'parse_uid', 'uid_str')
+__all__ = ('Uid', 'UidValidator', 'UidValueError', 'UidCodec', 'get_uid_codec', 'parse_uid', 'uid_str')
 
 import re
 from collections import namedtuple
 
-from flask import current_app
+from flask import current_app, has_app_context
 from hashids import Hashids
 from jsonschema import draft4_format_checker
 
+from ..lru_cache import LruCache
+
 
 Uid = namedtuple('Uid', 'prefix,serial_id,version')
 
@@ -41,6 +43,9 @@ class UidValidator:
     @classmethod
     def add_prefixes(cls, **prefixes):
         cls.VALID_PREFIXES.update(prefixes)
+        if UidCodec.default is not None:
+            # The canaries depend on the prefixes
+            UidCodec.default.clear()
 
     def __init__(self, salt=None, prefix=PREFIX_VALID, versioned=None):
         self.prefix = prefix
@@ -146,26 +151,97 @@ class UidValidator:
     def init_app(cls, app, valid_prefixes):
         cls.VALID_PREFIXES = valid_prefixes
         salt = app.config['UID_SALT']
-        validator = cls(prefix=cls.PREFIX_ANY, versioned=None, salt=salt).register()
-        cls(prefix=cls.PREFIX_ANY, versioned=True, salt=salt).register()
-        cls(prefix=cls.PREFIX_ANY, versioned=False, salt=salt).register()
+        codec = UidCodec(salt, maxsize=app.config.get('UID_CACHE_SIZE', 65536))
+        validator = codec.validator(prefix=cls.PREFIX_ANY, versioned=None).register()
+        codec.validator(prefix=cls.PREFIX_ANY, versioned=True).register()
+        codec.validator(prefix=cls.PREFIX_ANY, versioned=False).register()
 
-        cls(prefix=cls.PREFIX_VALID, versioned=None, salt=salt).register()
-        cls(prefix=cls.PREFIX_VALID, versioned=True, salt=salt).register()
-        cls(prefix=cls.PREFIX_VALID, versioned=False, salt=salt).register()
+        codec.validator(prefix=cls.PREFIX_VALID, versioned=None).register()
+        codec.validator(prefix=cls.PREFIX_VALID, versioned=True).register()
+        codec.validator(prefix=cls.PREFIX_VALID, versioned=False).register()
 
         for prefix in cls.VALID_PREFIXES:
             for versioned in (None, True, False):
-                cls(prefix=prefix, versioned=versioned, salt=salt).register()
+                codec.validator(prefix=prefix, versioned=versioned).register()
 
         app.extensions['uid_validator'] = validator
+        app.extensions['uid_codec'] = UidCodec.default = codec
+
+
+class UidCodec:
+    """
+    Encodes and decodes UIDs, with one validator (and hashids alphabet) per (prefix, versioned)
+    and a bounded cache of the recent results.
+    """
+
+    #: The codec of the last application initialized (see UidValidator.init_app), used outside of app contexts
+    default = None
+
+    def __init__(self, salt, maxsize=65536):
+        self.salt = salt
+        self._validators = {}
+        self._encoded = LruCache(maxsize=maxsize)
+        self._decoded = LruCache(maxsize=maxsize)
+
+    def validator(self, prefix=UidValidator.PREFIX_VALID, versioned=None):
+        key = (prefix, versioned)
+        validator = self._validators.get(key)
+        if validator is None:
+            self._validators[key] = validator = UidValidator(prefix=prefix, versioned=versioned, salt=self.salt)
+        return validator
+
+    def decode(self, val, prefix=None, versioned=None):
+        if val is None or val == '':
+            return None
+        prefix = UidValidator.PREFIX_VALID if prefix is None else prefix
+        if not isinstance(val, str):
+            # Let the validator complain
+            return self.validator(prefix, versioned).decode(val)
+        key = (val, prefix, versioned)
+        uid = self._decoded.get(key)
+        if uid is None:
+            # Errors are not cached, they are raised again
+            uid = self.validator(prefix, versioned).decode(val)
+            self._decoded.set(key, uid)
+        return uid
+
+    def encode(self, uid, valid=True, versioned=None):
+        if uid is None or uid.serial_id is None:
+            return None
+        key = (uid, valid, versioned)
+        encoded = self._encoded.get(key)
+        if encoded is None:
+            encoded = self.validator(UidValidator.PREFIX_ANY, None).encode(uid, valid=valid, versioned=versioned)
+            self._encoded.set(key, encoded)
+        return encoded
+
+    def decode_many(self, vals, prefix=None, versioned=None):
+        return [self.decode(val, prefix=prefix, versioned=versioned) for val in vals]
+
+    def encode_many(self, uids, valid=True, versioned=None):
+        return [self.encode(uid, valid=valid, versioned=versioned) for uid in uids]
+
+    def clear(self):
+        self._encoded.clear()
+        self._decoded.clear()
+
+    def stats(self):
+        return dict(encoded=self._encoded.stats(), decoded=self._decoded.stats())
+
+
+def get_uid_codec():
+    if not has_app_context() and UidCodec.default is not None:
+        # e.g. scripts, the codec of the last application initialized
+        return UidCodec.default
+    # Each application has its own salt
+    codec = current_app.extensions.get('uid_codec')
+    if codec is None:
+        current_app.extensions['uid_codec'] = codec = UidCodec(current_app.config['UID_SALT'])
+    return codec
 
 
 def parse_uid(val, version_id=None, prefix=None, versioned=None):
-    salt = current_app.config['UID_SALT']
-    prefix = UidValidator.PREFIX_VALID if prefix is None else prefix
-    validator = UidValidator(prefix=prefix, versioned=versioned, salt=salt)
-    uid = validator.decode(val)
+    uid = get_uid_codec().decode(val, prefix=prefix, versioned=versioned)
     if version_id:
         prefix, serial_id, version = uid
         assert not version
@@ -174,5 +250,4 @@ def parse_uid(val, version_id=None, prefix=None, versioned=None):
 
 
 def uid_str(valid=True, versioned=None, **uid):
-    validator = current_app.extensions['uid_validator']
-    return validator.encode(Uid(**uid), versioned=versioned)
+    return get_uid_codec().encode(Uid(**uid), valid=valid, versioned=versioned)
@@ -0,0 +1 @@
+from .fixtures.db import app, replica
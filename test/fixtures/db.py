@@ -0,0 +1,180 @@
+import logging
+import pytest
+import sqlalchemy as sa
+from sqlalchemy import orm
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.ext.orderinglist import ordering_list
+from crud_components import BaseModel, BaseModelWithId, BaseModelWithUid, CrudMetadata, MetadataBuilderFactory, \
+    DbHelper, Extension, Stage, UidValidator, extension_pre_flush, extension_property
+
+db = SQLAlchemy()
+BaseModel.query = db.session.query_property()
+
+
+#: The prefixes of the uids of the test models
+UID_PREFIXES = dict(WID=0x01, PRT=0x02)
+
+
+class Widget(BaseModelWithId):
+    __tablename__ = 'widget'
+
+    name = sa.Column(sa.String, nullable=False, info=dict(orderable=True, searchable=True))
+    rank = sa.Column(sa.Integer, nullable=True, info=dict(orderable=True, searchable=True))
+    code = sa.Column(sa.String, unique=True, nullable=True)
+
+
+class Part(BaseModelWithUid):
+    __tablename__ = 'part'
+    UID_PREFIX = 'PRT'
+
+    name = sa.Column(sa.String, nullable=False)
+    position = sa.Column(sa.Integer, info=dict(exposed=False))
+    widget_id = sa.Column(sa.Integer, sa.ForeignKey(Widget.id), info=dict(exposed=False))
+    widget = orm.relationship(Widget, back_populates='parts', info=dict(exposed=False))
+
+
+Widget.parts = orm.relationship(
+    Part, back_populates='widget', order_by=Part.position, collection_class=ordering_list('position'),
+    cascade='all, delete-orphan', info=dict(reference_creatable=True, reference_editable=True),
+)
+
+
+#: (stage, model name, instance name) of the model-level executions run
+EXECUTED = []
+#: (stage, model name, instance names) of the batched model-level executions run
+BATCHED = []
+
+
+class WidgetAudit(Extension):
+    __model__ = Widget
+    __implicit__ = True
+
+    @extension_pre_flush
+    def audit(self, value):
+        EXECUTED.append((Stage.PRE_FLUSH, 'Widget', self.instance.name))
+
+
+class PartAudit(Extension):
+    __model__ = Part
+    __implicit__ = True
+
+    @extension_pre_flush
+    def audit(self, value):
+        EXECUTED.append((Stage.PRE_FLUSH, 'Part', self.instance.name))
+
+    @extension_pre_flush(batched=True)
+    def audit_many(self, pairs):
+        BATCHED.append((Stage.PRE_FLUSH, 'Part', [instance.name for instance, _ in pairs]))
+
+
+class PartLabel(Extension):
+    """
+    Only exposed when asked for, with the names of the parts of each `expose_many` call in `batches`
+    """
+    __model__ = Part
+
+    def __init__(self, session, instance, batches=None):
+        super().__init__(session, instance)
+        self.batches = batches
+
+    @extension_property(type='string')
+    def label(self):
+        return self.instance.name.upper()
+
+    def expose_many(self, instances, field):
+        self.batches.append([instance.name for instance in instances])
+        return [instance.name.upper() for instance in instances]
+
+
+for model_cls in (Widget, Part):
+    model_cls.crud_metadata = CrudMetadata(model_cls, MetadataBuilderFactory())
+    model_cls.crud_metadata.build()
+
+
+@pytest.fixture
+def app(tmp_path):
+    """
+    An application bound to a SQLite file, the primary database
+    """
+    app = Flask(__name__)
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI='sqlite:///{}'.format(tmp_path / 'primary.db'),
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        DEFAULT_COUNT=10,
+        SEARCH_KEY='test',
+        UID_SALT='test',
+    )
+    UidValidator.init_app(app, dict(UID_PREFIXES))
+    db.init_app(app)
+    with app.test_request_context():
+        BaseModel.metadata.create_all(db.engine)
+        yield app
+        db.session.remove()
+    EXECUTED.clear()
+    BATCHED.clear()
+
+
+@pytest.fixture
+def replica(app, tmp_path):
+    """
+    A session bound to another SQLite file, standing for a read-only replica that did not catch up yet
+    """
+    engine = sa.create_engine('sqlite:///{}'.format(tmp_path / 'replica.db'))
+    BaseModel.metadata.create_all(engine)
+    session = orm.scoped_session(orm.sessionmaker(bind=engine))
+    yield session
+    session.remove()
+    engine.dispose()
+
+
+def add_widgets(session, *ranks):
+    """
+    Adds and commits a widget per rank
+    :return: their ids
+    """
+    widgets = [Widget(name='widget {}'.format(i), rank=rank) for i, rank in enumerate(ranks)]
+    session.add_all(widgets)
+    session.commit()
+    return [w.id for w in widgets]
+
+
+def search_all(helper, body):
+    """
+    Follows the pagination tokens until the last page
+    :return: the ids of all the results, and the total of the first page
+    """
+    output, _ = helper.query_search_helper(body)
+    total = output['pagination']['total']
+    ids = [r['id'] for r in output['results']]
+    while output['pagination']['more']:
+        output, _ = helper.query_search_helper(dict(body, paginationToken=output['pagination']['nextToken']))
+        ids.extend(r['id'] for r in output['results'])
+    return ids, total
+
+
+def make_helper(model_cls=Widget, **kwargs):
+    return DbHelper(logging.getLogger(__name__), db, model_cls=model_cls, **kwargs)
+
+
+class StatementRecorder:
+    """
+    Records the statements sent to an engine
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        sa.event.listen(self.engine, 'before_cursor_execute', self._before_cursor_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        sa.event.remove(self.engine, 'before_cursor_execute', self._before_cursor_execute)
+
+    def count(self, keyword):
+        return sum(1 for s in self.statements if s.lstrip().upper().startswith(keyword))
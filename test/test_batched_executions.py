@@ -0,0 +1,28 @@
+from crud_components import Stage
+from .fixtures.db import db, Widget, Part, EXECUTED, BATCHED, make_helper
+
+
+def test_batched_executions_run_once_per_chunk(app):
+    helper = make_helper(model_cls=Part)
+    creates = [dict(name='part {}'.format(i)) for i in range(5)]
+
+    helper.bulk_create_helper(dict(creates=creates), chunk_size=2)
+
+    assert BATCHED == [
+        (Stage.PRE_FLUSH, 'Part', ['part 0', 'part 1']),
+        (Stage.PRE_FLUSH, 'Part', ['part 2', 'part 3']),
+        (Stage.PRE_FLUSH, 'Part', ['part 4']),
+    ]
+    # The other executions still run for each instance
+    assert [name for _, _, name in EXECUTED] == ['part {}'.format(i) for i in range(5)]
+
+
+def test_batched_executions_of_the_children(app):
+    widget = Widget(name='widget 0', parts=[Part(name='part {}'.format(i)) for i in range(3)])
+    db.session.add(widget)
+    db.session.commit()
+    helper = make_helper()
+
+    helper.update_helper(widget.id, dict(parts=[dict(uid=p.uid) for p in widget.parts]))
+
+    assert BATCHED == [(Stage.PRE_FLUSH, 'Part', ['part 0', 'part 1', 'part 2'])]
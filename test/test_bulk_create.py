@@ -0,0 +1,20 @@
+from crud_components import Stage
+from .fixtures.db import db, Widget, EXECUTED, StatementRecorder, make_helper
+
+
+def test_bulk_create_flushes_per_chunk(app):
+    helper = make_helper()
+    creates = [dict(name='widget {}'.format(i), rank=i) for i in range(5)]
+
+    with StatementRecorder(db.engine) as recorder:
+        output, code = helper.bulk_create_helper(dict(creates=creates), chunk_size=2)
+    db.session.commit()
+
+    assert code == 201
+    assert [(r['name'], r['rank']) for r in output['results']] == [('widget {}'.format(i), i) for i in range(5)]
+    # Without a sequence (SQLite), the ids cannot be reserved and each row is inserted on its own
+    assert recorder.count('INSERT') == 5
+    assert Widget.query.count() == 5
+    assert [(stage, name) for stage, model, name in EXECUTED] == [
+        (Stage.PRE_FLUSH, 'widget {}'.format(i)) for i in range(5)
+    ]
@@ -0,0 +1,53 @@
+import pytest
+from crud_components import ProblemException
+from .fixtures.db import db, Widget, Part, StatementRecorder, make_helper
+
+
+def add_widget_with_parts(count):
+    widget = Widget(name='widget 0', parts=[Part(name='part {}'.format(i)) for i in range(count)])
+    db.session.add(widget)
+    db.session.commit()
+    return widget
+
+
+def test_bulk_delete_by_uids(app):
+    uids = [p.uid for p in add_widget_with_parts(5).parts]
+    helper = make_helper(model_cls=Part)
+    assert Part.can_delete_in_bulk()
+
+    with StatementRecorder(db.engine) as recorder:
+        output, _ = helper.bulk_delete_helper(dict(uids=uids[:3]), chunk_size=2)
+    db.session.commit()
+
+    assert output == dict(deleted=3)
+    assert (recorder.count('SELECT'), recorder.count('DELETE')) == (0, 2)
+    assert sorted(p.name for p in Part.query) == ['part 3', 'part 4']
+
+
+def test_bulk_delete_by_filter(app):
+    add_widget_with_parts(3)
+    helper = make_helper(model_cls=Part)
+
+    with StatementRecorder(db.engine) as recorder:
+        output, _ = helper.bulk_delete_helper(dict(filter=dict(name=dict(op='neq', value='part 1'))))
+    db.session.commit()
+
+    assert output == dict(deleted=2)
+    assert len(recorder.statements) == 1
+    assert [p.name for p in Part.query] == ['part 1']
+
+    with pytest.raises(ProblemException):
+        helper.bulk_delete_helper(dict())
+
+
+def test_bulk_delete_through_the_unit_of_work(app):
+    widget_id = add_widget_with_parts(2).id
+    helper = make_helper()
+    # The parts are deleted with their widget
+    assert not Widget.can_delete_in_bulk()
+
+    output, _ = helper.bulk_delete_helper(dict(uids=[widget_id]))
+    db.session.commit()
+
+    assert output == dict(deleted=1)
+    assert Widget.query.count() == 0 and Part.query.count() == 0
@@ -0,0 +1,32 @@
+from crud_components import Stage
+from .fixtures.db import db, Widget, EXECUTED, StatementRecorder, add_widgets, make_helper
+
+
+def test_bulk_update_loads_the_instances_at_once(app):
+    ids = add_widgets(db.session, 1, 2, 3)
+    db.session.expire_all()
+    helper = make_helper()
+
+    updates = {ids[0]: dict(rank=10), ids[1]: dict(rank=2), ids[2]: dict(rank=30)}
+    with StatementRecorder(db.engine) as recorder:
+        output, code = helper.bulk_update_helper(dict(updates=updates))
+    db.session.commit()
+
+    assert (output, code) == (dict(changes=2), 200)
+    assert recorder.count('SELECT') == 1
+    assert sorted(w.rank for w in Widget.query) == [2, 10, 30]
+    assert len(EXECUTED) == 3 and all(stage is Stage.PRE_FLUSH for stage, _, _ in EXECUTED)
+
+    output, _ = helper.bulk_update_helper(dict(updates={ids[0]: dict(rank=11)}), with_results=True)
+    assert (output['changes'], [r['rank'] for r in output['results']]) == (1, [11])
+
+
+def test_bulk_update_of_a_missing_instance(app):
+    ids = add_widgets(db.session, 1)
+    helper = make_helper()
+
+    output, code = helper.bulk_update_helper(dict(updates={ids[0]: dict(rank=10), ids[0] + 1: dict(rank=20)}))
+    db.session.commit()
+
+    assert code == 404
+    assert [w.rank for w in Widget.query] == [1]
@@ -0,0 +1,45 @@
+from crud_components import ModelWriteVisitor, Stage
+from .fixtures.db import db, Widget, EXECUTED, StatementRecorder, add_widgets, make_helper
+
+
+def test_noop_update_issues_no_statement(app):
+    ids = add_widgets(db.session, 1)
+    helper = make_helper()
+
+    with StatementRecorder(db.engine) as recorder:
+        output, code = helper.update_helper(ids[0], dict(name='widget 0', rank=1))
+        db.session.flush()
+    assert code == 200
+    assert output['rank'] == 1
+    assert recorder.count('UPDATE') == 0
+
+
+def test_update_issues_one_statement(app):
+    ids = add_widgets(db.session, 1)
+    helper = make_helper()
+
+    with StatementRecorder(db.engine) as recorder:
+        output, code = helper.update_helper(ids[0], dict(name='widget 0', rank=2))
+        db.session.flush()
+    assert output['rank'] == 2
+    assert recorder.count('UPDATE') == 1
+
+
+def test_noop_visit_of_an_expired_attribute(app):
+    ids = add_widgets(db.session, 1)
+    widget = Widget.query.get(ids[0])
+    db.session.expire(widget, ['rank'])
+
+    _, changes = ModelWriteVisitor(session=db.session).visit_model(widget, dict(rank=1), creating=False)
+    assert changes == 0
+    with StatementRecorder(db.engine) as recorder:
+        db.session.flush()
+    assert recorder.count('UPDATE') == 0
+
+
+def test_noop_update_runs_the_executions(app):
+    ids = add_widgets(db.session, 1)
+    helper = make_helper()
+
+    helper.update_helper(ids[0], dict(name='widget 0', rank=1))
+    assert EXECUTED == [(Stage.PRE_FLUSH, 'Widget', 'widget 0')]
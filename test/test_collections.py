@@ -0,0 +1,36 @@
+from crud_components import Stage
+from .fixtures.db import db, Widget, Part, EXECUTED, StatementRecorder, make_helper
+
+
+def add_widget_with_parts(*names):
+    widget = Widget(name='widget', parts=[Part(name=name) for name in names])
+    db.session.add(widget)
+    db.session.commit()
+    return widget
+
+
+def test_unchanged_collection_writes_nothing(app):
+    widget = add_widget_with_parts('a', 'b', 'c')
+    uids = [part.uid for part in widget.parts]
+    helper = make_helper()
+
+    with StatementRecorder(db.engine) as recorder:
+        helper.update_helper(widget.id, dict(parts=[dict(uid=uid) for uid in uids]))
+        db.session.flush()
+    assert recorder.count('UPDATE') == recorder.count('INSERT') == recorder.count('DELETE') == 0
+    # The children sent back unchanged still run their executions
+    assert [e for e in EXECUTED if e[1] == 'Part'] == [(Stage.PRE_FLUSH, 'Part', name) for name in 'abc']
+
+
+def test_removed_child_renumbers_the_next_ones(app):
+    widget = add_widget_with_parts('a', 'b', 'c')
+    a, b, c = widget.parts
+    helper = make_helper()
+
+    with StatementRecorder(db.engine) as recorder:
+        helper.update_helper(widget.id, dict(parts=[dict(uid=a.uid), dict(uid=c.uid)]))
+        db.session.flush()
+    assert [(p.name, p.position) for p in widget.parts] == [('a', 0), ('c', 1)]
+    assert recorder.count('DELETE') == 1
+    # Only c moved
+    assert recorder.count('UPDATE') == 1
@@ -0,0 +1,24 @@
+from .fixtures.db import Widget, Part
+
+
+def test_indexes_match_the_fields():
+    crud_metadata = Widget.crud_metadata
+    for f in crud_metadata.fields.values():
+        if f.exposed_name:
+            assert crud_metadata.find_field_by_exposed_name(f.exposed_name) is not None
+        for capability, predicate in crud_metadata.FIELD_CAPABILITIES.items():
+            assert (f in crud_metadata.fields_with(capability)) == predicate(f)
+    assert [f.exposed_name for f in crud_metadata.fields_with('orderable')] == ['name', 'rank', 'code']
+    assert [f.exposed_name for f in crud_metadata.fields_of_type('reference')] == ['parts']
+    assert crud_metadata.fields_with('executions') == ()
+
+
+def test_fields_with_before_build():
+    crud_metadata = Part.crud_metadata
+    by_capability, by_type = crud_metadata.fields_by_capability, crud_metadata.fields_by_type
+    crud_metadata.fields_by_capability = crud_metadata.fields_by_type = None
+    try:
+        assert crud_metadata.fields_with('readable') == tuple(by_capability['readable'])
+        assert crud_metadata.fields_of_type('integer') == tuple(by_type['integer'])
+    finally:
+        crud_metadata.fields_by_capability, crud_metadata.fields_by_type = by_capability, by_type
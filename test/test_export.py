@@ -0,0 +1,32 @@
+import csv
+import io
+import json
+import pytest
+from crud_components import ProblemException
+from .fixtures.db import db, add_widgets, make_helper
+
+
+def test_export_ndjson(app):
+    ids = add_widgets(db.session, 3, 1, 2)
+    helper = make_helper()
+
+    chunks = list(helper.export_helper(dict(order=[dict(field='rank', order='asc')]), chunk_size=2))
+
+    assert len(chunks) == 2
+    rows = [json.loads(line) for chunk in chunks for line in chunk.decode().splitlines()]
+    assert [(r['id'], r['rank']) for r in rows] == [(ids[1], 1), (ids[2], 2), (ids[0], 3)]
+
+
+def test_export_csv(app):
+    add_widgets(db.session, 1, None)
+    helper = make_helper()
+
+    data = b''.join(helper.export_helper(dict(filter=dict(rank=dict(op='gt', value=0))), helper.EXPORT_CSV))
+
+    rows = list(csv.DictReader(io.StringIO(data.decode())))
+    assert [(r['name'], r['rank'], r['parts']) for r in rows] == [('widget 0', '1', '[]')]
+
+
+def test_export_unknown_format(app):
+    with pytest.raises(ProblemException):
+        make_helper().export_helper(dict(), 'xml')
@@ -0,0 +1,23 @@
+from .fixtures.db import db, Widget, Part, PartLabel, make_helper
+
+
+def add_parts(count):
+    db.session.add(Widget(name='widget 0', parts=[Part(name='part {}'.format(i)) for i in range(count)]))
+    db.session.commit()
+
+
+def test_expose_many_once_per_page(app):
+    add_parts(3)
+    batches = []
+    helper = make_helper(model_cls=Part)
+
+    output, _ = helper.query_search_helper(
+        dict(count=2, fields=['label']), with_extensions=[PartLabel.with_arguments(batches=batches)])
+    assert [r['label'] for r in output['results']] == ['PART 0', 'PART 1']
+    assert batches == [['part 0', 'part 1']]
+
+
+def test_skipped_without_the_extension(app):
+    add_parts(1)
+    output, _ = make_helper(model_cls=Part).query_search_helper(dict(fields=['label']))
+    assert 'label' not in output['results'][0]
@@ -0,0 +1,40 @@
+import pytest
+from crud_components import DbHelper, ProblemException
+from .fixtures.db import db, Widget, add_widgets, make_helper, search_all
+
+
+def test_keyset_pagination_over_nullable_keys(app):
+    # SQLite sorts the NULLs last when descending, a page ends on a non-NULL key before reaching them
+    ids = add_widgets(db.session, 3, None, 1, None, 2)
+    helper = make_helper(pagination_mode=DbHelper.PAGINATION_KEYSET)
+    found, total = search_all(helper, dict(count=2, order=[dict(field='rank', order='desc')]))
+    assert total == 5
+    assert sorted(found) == sorted(ids)
+
+
+def test_keyset_token_seeks_after_the_last_row(app):
+    add_widgets(db.session, 1, 2, 3, 4)
+    helper = make_helper(pagination_mode=DbHelper.PAGINATION_KEYSET)
+    body = dict(count=2, order=[dict(field='name', order='asc')])
+    output, _ = helper.query_search_helper(body)
+    assert [r['rank'] for r in output['results']] == [1, 2]
+
+    # A row inserted before the last one read does not shift the next page, as it would with an offset
+    db.session.add(Widget(name='widget -', rank=0))
+    db.session.commit()
+    output, _ = helper.query_search_helper(dict(body, paginationToken=output['pagination']['nextToken']))
+    assert [r['rank'] for r in output['results']] == [3, 4]
+
+
+def test_keyset_token_of_another_search(app):
+    add_widgets(db.session, 1, 2, 3)
+    helper = make_helper(pagination_mode=DbHelper.PAGINATION_KEYSET)
+    output, _ = helper.query_search_helper(dict(count=2, order=[dict(field='rank', order='asc')]))
+    token = output['pagination']['nextToken']
+
+    # The token does not belong to this search, it starts over
+    output, _ = helper.query_search_helper(dict(count=2, order=[dict(field='rank', order='desc')], paginationToken=token))
+    assert [r['rank'] for r in output['results']] == [3, 2]
+
+    with pytest.raises(ProblemException):
+        helper.query_search_helper(dict(count=2, paginationToken=token[:-2] + 'xx'))
@@ -0,0 +1,52 @@
+from crud_components import LoaderPlan
+from .fixtures.db import db, Widget, Part, StatementRecorder, make_helper
+
+
+def add_widgets_with_parts(count, parts_count):
+    db.session.add_all(
+        Widget(name='widget {}'.format(i), parts=[Part(name='part {}.{}'.format(i, j)) for j in range(parts_count)])
+        for i in range(count)
+    )
+    db.session.commit()
+    db.session.expire_all()
+
+
+def test_projection_keeps_the_position_of_the_children(app):
+    add_widgets_with_parts(3, 2)
+    helper = make_helper()
+    with StatementRecorder(db.engine) as recorder:
+        output, _ = helper.query_search_helper(dict(fields=['name', 'parts']))
+
+    # The ordering_list reads the position of the children it is loaded with, without a query per child
+    assert [s for s in recorder.statements if 'FROM part' in s] == [
+        next(s for s in recorder.statements if 'FROM part' in s)
+    ]
+    assert [p['name'] for p in output['results'][0]['parts']] == ['part 0.0', 'part 0.1']
+
+
+def test_projection_of_the_columns(app):
+    plan = LoaderPlan(Widget, ('name', ), project_columns=True)
+    assert plan.columns[()] >= {'id', 'name'}
+    assert plan.columns[((Widget, 'parts', 'selectin'), )] == {'id', 'name', 'position'}
+    assert LoaderPlan(Widget, ('name', )).columns == {}
+
+
+def test_eager_loading_does_not_depend_on_the_page_size(app):
+    statements = []
+    for count in (2, 5):
+        add_widgets_with_parts(count, 2)
+        with StatementRecorder(db.engine) as recorder:
+            output, _ = make_helper().query_search_helper(dict(fields=['name', 'parts']))
+        statements.append(len(recorder.statements))
+        assert all(len(r['parts']) == 2 for r in output['results'])
+    assert statements[0] == statements[1]
+
+    with StatementRecorder(db.engine) as recorder:
+        make_helper(eager_load=False).query_search_helper(dict(fields=['name', 'parts']))
+    assert len(recorder.statements) > statements[1]
+
+
+def test_eager_loading_plan(app):
+    assert LoaderPlan(Widget, ('name', 'parts')).paths == (((Widget, 'parts', 'selectin'), ), )
+    # References that are not exposed are not read
+    assert LoaderPlan(Part, ('widget', )).paths == ()
@@ -0,0 +1,36 @@
+import pytest
+from .fixtures.db import db, Widget, Part, StatementRecorder, make_helper
+
+
+def add_widgets_with_parts(count):
+    widgets = [
+        Widget(name='widget {}'.format(i), parts=[Part(name='part {}.{}'.format(i, j)) for j in range(2)])
+        for i in range(count)
+    ]
+    db.session.add_all(widgets)
+    db.session.commit()
+    return {w.id: [p.uid for p in w.parts] for w in widgets}
+
+
+def test_references_are_prefetched_at_once(app):
+    uids = add_widgets_with_parts(3)
+    db.session.expire_all()
+    helper = make_helper()
+
+    updates = {widget_id: dict(parts=[dict(uid=uid) for uid in reversed(part_uids)])
+               for widget_id, part_uids in uids.items()}
+    with StatementRecorder(db.engine) as recorder:
+        helper.bulk_update_helper(dict(updates=updates))
+    db.session.commit()
+
+    assert sum(1 for s in recorder.statements if 'part.id IN' in s) == 1
+    assert {w.name: [p.name for p in w.parts] for w in Widget.query} == {
+        'widget {}'.format(i): ['part {}.1'.format(i), 'part {}.0'.format(i)] for i in range(3)
+    }
+
+
+def test_invalid_uids_are_left_to_the_visits(app):
+    uids = add_widgets_with_parts(1)
+    helper = make_helper()
+    with pytest.raises(ValueError):
+        helper.bulk_update_helper(dict(updates={widget_id: dict(parts=[dict(uid='nope')]) for widget_id in uids}))
@@ -0,0 +1,43 @@
+import time
+from flask import g
+from crud_components import DbHelper
+from .fixtures.db import db, Widget, add_widgets, make_helper
+
+
+def search_total(helper):
+    output, _ = helper.query_search_helper(dict())
+    return output['pagination']['total']
+
+
+def test_reads_go_to_the_replica(app, replica):
+    add_widgets(db.session, 1, 2)
+    add_widgets(replica, 1)
+    helper = make_helper(read_session=replica)
+
+    assert search_total(helper) == 1
+    # Only the primary has the second widget
+    assert helper.get_helper(2, None)[1] == 404
+
+
+def test_reads_stick_to_the_primary_after_a_write(app, replica):
+    ids = add_widgets(db.session, 1, 2)
+    add_widgets(replica, 1)
+    helper = make_helper(read_session=replica, read_your_writes_window=5)
+
+    helper.create_helper(dict(name='new', rank=3))
+    db.session.commit()
+    assert search_total(helper) == 3
+    assert helper.get_helper(ids[1], None)[1] == 200
+
+    # Once the window is over, the reads go back to the replica
+    setattr(g, DbHelper.LAST_WRITE_ATTRIBUTE, time.monotonic() - 10)
+    assert search_total(helper) == 1
+
+
+def test_uncommitted_writes_read_the_primary(app, replica):
+    add_widgets(db.session, 1, 2)
+    add_widgets(replica, 1)
+    helper = make_helper(read_session=replica)
+
+    db.session.add(Widget(name='pending', rank=3))
+    assert search_total(helper) == 3
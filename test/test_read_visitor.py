@@ -0,0 +1,35 @@
+from crud_components import ModelReadVisitor
+from .fixtures.db import db, Widget, Part
+
+
+class UpperReadVisitor(ModelReadVisitor):
+
+    def visit_value(self, instance, field, value, field_names):
+        value = super().visit_value(instance, field, value, field_names)
+        return value.upper() if isinstance(value, str) and field.exposed_name == 'name' else value
+
+
+def add_widget():
+    widget = Widget(name='widget 0', rank=1, parts=[Part(name='part 0')])
+    db.session.add(widget)
+    db.session.commit()
+    return widget
+
+
+def test_read_plan_is_shared(app):
+    add_widget()
+    visitor, other = ModelReadVisitor(db.session), ModelReadVisitor(db.session)
+    plan = visitor.read_plan(Widget.crud_metadata, ('parts', 'name'))
+    assert other.read_plan(Widget.crud_metadata, ('name', 'parts')) is plan
+    assert plan.visits is not None
+    # Overriding the visits disables the prebuilt ones
+    assert UpperReadVisitor(db.session).read_plan(Widget.crud_metadata, ('parts', 'name')).visits is None
+
+
+def test_prebuilt_visits_read_like_visit_field(app):
+    widget = add_widget()
+    dikt = ModelReadVisitor(db.session).visit_model(widget, field_names=('name', 'parts'))
+    assert dikt == dict(id=widget.id, name='widget 0', rank=1, code=None, parts=[dict(uid=widget.parts[0].uid, name='part 0')])
+
+    dikt = UpperReadVisitor(db.session).visit_model(widget, field_names=('name', 'parts'))
+    assert (dikt['name'], dikt['parts'][0]['name']) == ('WIDGET 0', 'PART 0')
@@ -0,0 +1,65 @@
+import pytest
+import sqlalchemy as sa
+from crud_components import SearchResponseCache
+from crud_components.crud_helpers.search_cache import SearchCacheBackend
+from .fixtures.db import db, Widget, Part, StatementRecorder, add_widgets, make_helper
+
+
+def test_backend_is_abstract():
+    class IncompleteBackend(SearchCacheBackend):
+        def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        IncompleteBackend()
+
+
+def test_commit_invalidates_the_responses(app):
+    ids = add_widgets(db.session, 1, 2)
+    helper = make_helper(response_cache=SearchResponseCache())
+
+    output, _ = helper.query_search_helper(dict())
+    with StatementRecorder(db.engine) as recorder:
+        assert helper.query_search_helper(dict())[0] == output
+    assert recorder.count('SELECT') == 0
+
+    # The responses of widgets depend on the parts they reference
+    db.session.add(Part(name='part 0', widget_id=ids[0]))
+    db.session.commit()
+    with StatementRecorder(db.engine) as recorder:
+        helper.query_search_helper(dict())
+    assert recorder.count('SELECT') > 0
+
+    db.session.add(Widget(name='widget 2'))
+    db.session.commit()
+    assert helper.query_search_helper(dict())[0]['pagination']['total'] == 3
+
+
+def test_cached_response_racing_a_commit(app):
+    add_widgets(db.session, 1, 2)
+    cache = SearchResponseCache()
+    helper = make_helper(response_cache=cache)
+    engine = db.engine
+
+    committed = []
+
+    def commit_meanwhile(conn, cursor, statement, parameters, context, executemany):
+        # Another transaction commits while the search runs, after its queries
+        if 'count(' in statement and not committed:
+            committed.append(True)
+            cache.invalidate([Widget.__tablename__])
+
+    sa.event.listen(engine, 'after_cursor_execute', commit_meanwhile)
+    try:
+        output, _ = helper.query_search_helper(dict())
+    finally:
+        sa.event.remove(engine, 'after_cursor_execute', commit_meanwhile)
+    assert committed
+    assert output['pagination']['total'] == 2
+
+    # What that transaction wrote, without going through the session (it would invalidate the cache again)
+    with engine.connect() as other:
+        other.execute(Widget.__table__.insert().values(name='late', rank=3))
+
+    output, _ = helper.query_search_helper(dict())
+    assert output['pagination']['total'] == 3
@@ -0,0 +1,82 @@
+from crud_components import CountStrategy
+from .fixtures.db import db, Widget, StatementRecorder, add_widgets, make_helper
+
+
+def count_statements(recorder):
+    return sum(1 for s in recorder.statements if 'count(' in s)
+
+
+def test_none(app):
+    add_widgets(db.session, 1, 2, 3)
+    helper = make_helper(count_strategy=CountStrategy.NONE)
+    with StatementRecorder(db.engine) as recorder:
+        output, _ = helper.query_search_helper(dict(count=2))
+    assert count_statements(recorder) == 0
+    assert output['pagination']['total'] is None
+    assert output['pagination']['totalStrategy'] == 'none'
+    assert output['pagination']['more']
+
+
+def test_carry(app):
+    add_widgets(db.session, 1, 2, 3)
+    helper = make_helper(count_strategy=CountStrategy.CARRY)
+    output, _ = helper.query_search_helper(dict(count=2))
+    assert output['pagination']['total'] == 3
+
+    with StatementRecorder(db.engine) as recorder:
+        output, _ = helper.query_search_helper(dict(count=2, paginationToken=output['pagination']['nextToken']))
+    assert count_statements(recorder) == 0
+    assert (output['pagination']['total'], output['pagination']['totalStrategy']) == (3, 'carry')
+
+
+def test_cached(app):
+    add_widgets(db.session, 1, 2, 3)
+    helper = make_helper(count_strategy=CountStrategy.CACHED)
+    assert helper.query_search_helper(dict(count=2))[0]['pagination']['total'] == 3
+
+    db.session.add(Widget(name='widget 3'))
+    db.session.commit()
+    with StatementRecorder(db.engine) as recorder:
+        output, _ = helper.query_search_helper(dict(count=2))
+    # Until the entry expires
+    assert count_statements(recorder) == 0
+    assert (output['pagination']['total'], output['pagination']['totalStrategy']) == (3, 'cached')
+
+
+def test_estimated_needs_postgresql(app):
+    add_widgets(db.session, 1, 2, 3)
+    helper = make_helper(count_strategy=CountStrategy.ESTIMATED)
+    output, _ = helper.query_search_helper(dict(count=2))
+    assert (output['pagination']['total'], output['pagination']['totalStrategy']) == (3, 'exact')
+
+
+def test_strategy_of_the_request_wins(app, monkeypatch):
+    add_widgets(db.session, 1, 2, 3)
+    monkeypatch.setattr(Widget.crud_metadata, 'count_strategy', CountStrategy.NONE)
+    helper = make_helper(count_strategy=CountStrategy.CARRY)
+    assert helper.query_search_helper(dict(count=2))[0]['pagination']['totalStrategy'] == 'none'
+    output, _ = helper.query_search_helper(dict(count=2), count_strategy=CountStrategy.EXACT)
+    assert output['pagination']['totalStrategy'] == 'exact'
+
+
+def test_window(app):
+    add_widgets(db.session, 1, 2, 3)
+    helper = make_helper(count_strategy=CountStrategy.WINDOW)
+    with StatementRecorder(db.engine) as recorder:
+        output, _ = helper.query_search_helper(dict(count=2, filter=dict(rank=dict(op='gt', value=1))))
+    # The total comes with the page
+    assert [s for s in recorder.statements if 'count(' in s] == [s for s in recorder.statements if 'OVER' in s]
+    assert count_statements(recorder) == 1
+    assert (output['pagination']['total'], output['pagination']['totalStrategy']) == (2, 'window')
+    assert [r['rank'] for r in output['results']] == [2, 3]
+    assert all('total' not in r for r in output['results'])
+
+
+def test_window_past_the_last_page(app):
+    add_widgets(db.session, 1, 2, 3)
+    helper = make_helper(count_strategy=CountStrategy.WINDOW)
+    output, _ = helper.query_search_helper(dict(count=2))
+    output, _ = helper.query_search_helper(dict(count=2, page=5, paginationToken=output['pagination']['nextToken']))
+    # Counted again to go back to the last page
+    assert (output['pagination']['total'], output['pagination']['page']) == (3, 2)
+    assert [r['rank'] for r in output['results']] == [3]
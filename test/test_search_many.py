@@ -0,0 +1,37 @@
+from crud_components import CountStrategy, UserFilters, make_search_queries
+from .fixtures.db import db, Widget, Part, StatementRecorder, add_widgets, make_helper
+
+
+def test_search_many_counts_in_one_statement(app):
+    add_widgets(db.session, 1, 2, 3)
+    helper = make_helper()
+    bodies = [dict(filter=dict(rank=dict(op='gt', value=v))) for v in (0, 1, 2)]
+    with StatementRecorder(db.engine) as recorder:
+        rv = helper.query_search_many(bodies)
+    assert [output['pagination']['total'] for output, _ in rv] == [3, 2, 1]
+    assert sum(1 for s in recorder.statements if 'count(' in s) == 1
+
+
+def test_search_many_counts_like_the_searches(app):
+    widget = Widget(name='widget 0', parts=[Part(name='part {}'.format(i)) for i in range(4)])
+    db.session.add(widget)
+    db.session.commit()
+    uids = [p.uid for p in widget.parts]
+    helper = make_helper(model_cls=Part)
+    bodies = [
+        dict(),
+        dict(exclude=[uids[1]]),
+        dict(include=[uids[2]], exclude=[uids[3]]),
+    ]
+
+    count_memo = dict()
+    helper._count_many(bodies, count_memo)
+    totals = []
+    for body in bodies:
+        filters = UserFilters(
+            Part, None, filter=body.get('filter'), order=body.get('order'), term=body.get('term'),
+            include=body.get('include'), exclude=body.get('exclude'),
+        )
+        _, total_query, _ = make_search_queries(Part, filters, None, None)
+        totals.append((count_memo[CountStrategy.EXACT, repr(filters)][0], total_query.scalar()))
+    assert [memoized for memoized, _ in totals] == [total for _, total in totals]
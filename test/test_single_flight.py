@@ -0,0 +1,78 @@
+import asyncio
+import threading
+import pytest
+from crud_components import SingleFlight
+from .fixtures.db import db, add_widgets, make_helper
+
+
+def test_concurrent_calls_are_coalesced():
+    single_flight = SingleFlight(timeout=5)
+    started, release = threading.Event(), threading.Event()
+    calls, results = [], []
+
+    def search():
+        calls.append(None)
+        started.set()
+        release.wait(5)
+        return 'rows'
+
+    def follower():
+        results.append(single_flight.do('key', search))
+
+    leader = threading.Thread(target=lambda: results.append(single_flight.do('key', search)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=follower) for _ in range(3)]
+    for t in followers:
+        t.start()
+    release.set()
+    for t in (leader, *followers):
+        t.join(5)
+
+    assert len(calls) == 1
+    assert sorted(results, key=lambda r: not r[1]) == [('rows', True)] + [('rows', False)] * 3
+    # Nothing is kept past the call
+    assert single_flight.do('key', lambda: 'fresh') == ('fresh', True)
+
+
+def test_concurrent_coroutines_are_coalesced():
+    single_flight = SingleFlight()
+    calls = []
+
+    async def search():
+        calls.append(None)
+        await asyncio.sleep(0.01)
+        return 'rows'
+
+    async def main():
+        return await asyncio.gather(*(single_flight.do_async('key', search) for _ in range(3)))
+
+    assert asyncio.run(main()) == [('rows', True), ('rows', False), ('rows', False)]
+    assert len(calls) == 1
+
+
+def test_waiting_coroutines_get_the_exception():
+    single_flight = SingleFlight()
+
+    async def search():
+        await asyncio.sleep(0.01)
+        raise ValueError
+
+    async def main():
+        return await asyncio.gather(
+            *(single_flight.do_async('key', search) for _ in range(2)), return_exceptions=True)
+
+    assert [type(r) for r in asyncio.run(main())] == [ValueError, ValueError]
+
+
+def test_search_many_with_single_flight(app):
+    add_widgets(db.session, 1, 2, 3)
+    helper = make_helper(single_flight=SingleFlight())
+    bodies = [
+        dict(filter=dict(rank=dict(op='gt', value=1))),
+        dict(filter=dict(rank=dict(op='gt', value=2))),
+        dict(filter=dict(rank=dict(op='gt', value=1))),
+    ]
+    rv = helper.query_search_many(bodies)
+    assert [output['pagination']['total'] for output, _ in rv] == [2, 1, 2]
+    assert [code for _, code in rv] == [200, 200, 200]
@@ -0,0 +1,20 @@
+from crud_components import SearchStatementCache
+from .fixtures.db import db, add_widgets, make_helper
+
+
+def search_ranks(helper, value):
+    output, _ = helper.query_search_helper(dict(filter=dict(rank=dict(op='gt', value=value)), order=[dict(field='rank', order='asc')]))
+    return [r['rank'] for r in output['results']], output['pagination']['total']
+
+
+def test_searches_of_the_same_shape_share_their_statements(app):
+    add_widgets(db.session, 1, 2, 3)
+    cache = SearchStatementCache()
+    helper = make_helper(statement_cache=cache)
+
+    assert search_ranks(helper, 1) == ([2, 3], 2)
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    # Same shape, other values: the statements are reused with the new parameters
+    assert search_ranks(helper, 2) == ([3], 1)
+    assert (cache.hits, cache.misses) == (1, 1)
@@ -0,0 +1,31 @@
+from flask import Flask
+from crud_components import Uid, UidValidator, get_uid_codec, parse_uid, uid_str
+from .fixtures.db import UID_PREFIXES
+
+
+def make_app(salt):
+    app = Flask(__name__)
+    app.config['UID_SALT'] = salt
+    UidValidator.init_app(app, dict(UID_PREFIXES))
+    return app
+
+
+def test_encode_and_decode_many():
+    with make_app('salt').app_context():
+        codec = get_uid_codec()
+        uids = [Uid(prefix='WID', serial_id=i, version=0) for i in (1, 2, 1)]
+        encoded = codec.encode_many(uids)
+        assert encoded[0] == encoded[2] != encoded[1]
+        assert [uid.serial_id for uid in codec.decode_many(encoded)] == [1, 2, 1]
+        assert parse_uid(encoded[1]).serial_id == 2
+
+
+def test_each_application_uses_its_salt():
+    first, second = make_app('first salt'), make_app('second salt')
+    with first.app_context():
+        encoded_first = uid_str(prefix='WID', serial_id=1, version=0)
+    with second.app_context():
+        encoded_second = uid_str(prefix='WID', serial_id=1, version=0)
+    assert encoded_first != encoded_second
+    with first.app_context():
+        assert parse_uid(encoded_first).serial_id == 1
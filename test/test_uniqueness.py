@@ -0,0 +1,25 @@
+import pytest
+from crud_components import ModelValidationError
+from .fixtures.db import db, Widget, StatementRecorder
+
+
+def test_uniqueness_of_many_instances_in_one_query(app):
+    db.session.add(Widget(name='widget 0', code='a'))
+    db.session.commit()
+
+    widgets = [Widget(name='widget {}'.format(i), code=code) for i, code in enumerate(('b', 'c', None, None), 1)]
+    db.session.add_all(widgets)
+    with StatementRecorder(db.engine) as recorder:
+        Widget.assert_uniqueness_many(widgets)
+    assert recorder.count('SELECT') == 1
+
+    widgets[0].code = 'a'
+    with pytest.raises(ModelValidationError):
+        Widget.assert_uniqueness_many(widgets)
+
+
+def test_uniqueness_among_the_instances(app):
+    widgets = [Widget(name='widget 0', code='a'), Widget(name='widget 1', code='a')]
+    db.session.add_all(widgets)
+    with pytest.raises(ModelValidationError):
+        widgets[0].assert_uniqueness()
@@ -0,0 +1,54 @@
+from sqlalchemy.dialects import postgresql
+from crud_components import Stage
+from .fixtures.db import db, Widget, Part, EXECUTED, add_widgets, make_helper, StatementRecorder
+
+
+def test_upsert_statement():
+    helper = make_helper()
+    rows = [dict(name='widget 0', rank=1), dict(name='widget 1', rank=2), dict(name='widget 2')]
+    statements = helper._upsert_statements(rows, ('name',))
+
+    # One statement per set of columns
+    assert len(statements) == 2
+    sql = str(statements[0].compile(dialect=postgresql.dialect()))
+    assert 'ON CONFLICT (name) DO UPDATE SET rank = excluded.rank' in sql
+    assert sql.endswith('RETURNING widget.id, xmax = 0 AS inserted')
+
+
+def test_upsert_through_the_write_visitor(app):
+    add_widgets(db.session, 1, 2)
+    helper = make_helper()
+
+    result, status = helper.upsert_helper(
+        dict(upserts=[dict(name='widget 1', rank=5), dict(name='widget 2', rank=6)]), upsert_key=('name',))
+    db.session.commit()
+
+    assert (result, status) == (dict(inserted=1, updated=1), 200)
+    assert sorted((w.name, w.rank) for w in Widget.query) == [('widget 0', 1), ('widget 1', 5), ('widget 2', 6)]
+    assert sorted(EXECUTED) == [(Stage.PRE_FLUSH, 'Widget', 'widget 1'), (Stage.PRE_FLUSH, 'Widget', 'widget 2')]
+
+
+def test_upsert_prefetches_the_references_once_per_chunk(app):
+    widget = Widget(name='widget 0', parts=[Part(name='part {}'.format(i)) for i in range(4)])
+    db.session.add(widget)
+    db.session.commit()
+    uids = [p.uid for p in widget.parts]
+    db.session.expire_all()
+    helper = make_helper()
+
+    upserts = [
+        dict(name='widget 0', parts=[dict(uid=uids[0]), dict(uid=uids[1])]),
+        dict(name='widget 1', parts=[dict(uid=uids[2])]),
+        dict(name='widget 2', parts=[dict(uid=uids[3])]),
+    ]
+    with StatementRecorder(db.engine) as recorder:
+        result, _ = helper.upsert_helper(dict(upserts=upserts), upsert_key=('name',))
+    db.session.commit()
+
+    assert result == dict(inserted=2, updated=1)
+    # One query for the parts of the new widgets, one for those of the existing one
+    assert sum(1 for s in recorder.statements if s.lstrip().startswith('SELECT') and 'FROM part' in s
+               and 'part.id IN' in s) == 2
+    assert {w.name: [p.name for p in w.parts] for w in Widget.query} == {
+        'widget 0': ['part 0', 'part 1'], 'widget 1': ['part 2'], 'widget 2': ['part 3'],
+    }
@@ -0,0 +1,31 @@
+import pytest
+from crud_components import ModelValidationError, ModelWriteVisitor
+from .fixtures.db import Widget
+
+
+def whitelist(dikt, creating, only_field_names=None, **kwargs):
+    return {
+        name: field_names
+        for name, _, _, field_names in ModelWriteVisitor.whitelist(
+            Widget.crud_metadata, dikt, creating, only_field_names, **kwargs)
+    }
+
+
+def test_write_plans_are_cached():
+    crud_metadata = Widget.crud_metadata
+    plan = crud_metadata.write_plan(True, ['name', 'parts.name'])
+    assert crud_metadata.write_plan(True, ('parts.name', 'name')) is plan
+    assert crud_metadata.write_plan(False, ('parts.name', 'name')) is not plan
+
+    crud_metadata.build_indexes()
+    assert crud_metadata.write_plan(True, ['name', 'parts.name']) is not plan
+
+
+def test_whitelist():
+    body = dict(id=1, name='widget', rank=1, parts=[])
+    assert whitelist(body, True) == dict(name=None, rank=None, parts=None)
+    assert whitelist(body, True, ['name', 'parts.name']) == dict(name=frozenset(), parts=frozenset(['name']))
+
+    with pytest.raises(ModelValidationError):
+        whitelist(dict(body, color='red'), False, ignore_extra=False)
+    assert 'color' in whitelist(dict(body, color='red'), False, ignore_extra=False, keep_extra=True)